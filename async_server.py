@@ -0,0 +1,123 @@
+import asyncio
+import time
+from napster_server import NapsterServer, logger
+from worker_pool import Admission
+from protocol import encode_frame, parse_frame_header, MAX_FRAME_SIZE
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class AsyncNapsterServer(NapsterServer):
+    def __init__(self, host='localhost', port=1234, backlog=4096, buffer_limit=8192, data_folder=None,
+                 max_connections=None, max_per_ip=16):
+        super().__init__(host, port, data_folder=data_folder, backlog=backlog)
+        self.buffer_limit = buffer_limit
+        # Conexões custam pouco no loop: sem teto global (o limite de descritores já é
+        # o teto real), só o limite por IP
+        self.admission = Admission(max_connections, max_per_ip)
+        self.loop = None
+        self.writers = set()
+
+    def start(self):
+        self.raise_file_limit()
+        self.open_store()
+        self.start_lease_sweeper()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nServidor sendo encerrado...")
+        finally:
+            self.running = False
+            self.close_store()
+
+    def raise_file_limit(self):
+        # Cada par conectado consome um descritor; o limite padrão (1024) é baixo demais
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            print(f"Não foi possível aumentar o limite de descritores: {e}")
+
+    def close_session(self, session):
+        # A varredura roda em outra thread; o writer só pode ser fechado pelo loop
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(session.close)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(
+            self.handle_connection,
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            limit=self.buffer_limit
+        )
+
+        print(f"Servidor (asyncio) iniciado em {self.host}:{self.port}")
+        print("Aguardando conexões...")
+
+        async with server:
+            try:
+                # start_server já aceita conexões; serve_forever() não serve aqui porque,
+                # ao ser cancelado, ele mesmo espera wait_closed() antes deste finally
+                await self.loop.create_future()
+            finally:
+                # Ctrl+C cancela esta tarefa antes das conexões; marcar o fim aqui impede
+                # que os handlers cancelados esvaziem o catálogo antes do snapshot
+                self.running = False
+                # A partir do 3.12 a saída do `async with` espera todas as conexões
+                # terminarem; sem derrubá-las o Ctrl+C ficaria preso em wait_closed()
+                for writer in list(self.writers):
+                    writer.transport.abort()
+
+    async def read_message(self, reader):
+        try:
+            header = await reader.readuntil(b'\n')
+            size = parse_frame_header(header, MAX_FRAME_SIZE)
+            payload = await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            return None
+        return payload.decode('utf-8')
+
+    async def handle_connection(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        ip_address = address[0]
+        logger.debug("Nova conexão de %s", address)
+        reason = self.admission.admit(ip_address)
+        if reason is not None:
+            self.metrics.increment('connections.rejected')
+            logger.warning("Conexão de %s recusada: %s", address, reason)
+            writer.write(encode_frame(f"BUSY {reason}"))
+            writer.close()
+            return
+        self.metrics.increment('connections.active')
+        self.writers.add(writer)
+        try:
+            while self.running:
+                data = await self.read_message(reader)
+                if data is None:
+                    break
+
+                started = time.perf_counter()
+                response = self.process_command(writer, ip_address, data.strip())
+                for frame in self.response_frames(response):
+                    writer.write(encode_frame(frame))
+                    await writer.drain()
+                self.record_latency(data, started)
+
+        except Exception as e:
+            self.metrics.increment('errors.connection')
+            logger.warning("Erro ao lidar com cliente %s: %s", address, e)
+        finally:
+            self.metrics.increment('connections.active', -1)
+            self.writers.discard(writer)
+            self.admission.release(ip_address)
+            if self.running:
+                self.user_leave(ip_address)
+            writer.close()
+            logger.debug("Cliente %s desconectado", address)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+from file_handler import FileManager
+from protocol import MessageStream, set_socket_buffers, RECV_BUFFER_SIZE, SOCKET_BUFFER_SIZE
+
+def send_chunked(file_manager, sock, filename, offset_start, bytes_to_send):
+    # Laço original de handle_file_request: leituras e envios de 1 KiB
+    with open(file_manager.get_file_path(filename), 'rb') as f:
+        f.seek(offset_start)
+        sent = 0
+        while sent < bytes_to_send:
+            data = f.read(min(1024, bytes_to_send - sent))
+            if not data:
+                break
+            sock.sendall(data)
+            sent += len(data)
+
+def send_sendfile(file_manager, sock, filename, offset_start, bytes_to_send):
+    file_manager.send_file_range(sock, filename, offset_start, bytes_to_send)
+
+SENDERS = {
+    'chunked': send_chunked,
+    'sendfile': send_sendfile,
+}
+
+def receive_chunked(stream, fd, size, buffer_size):
+    # Laço original do download: recv de 1 KiB, um bytes novo por leitura
+    received = 0
+    while received < size:
+        data = stream.recv(min(1024, size - received))
+        if not data:
+            break
+        os.pwrite(fd, data, received)
+        received += len(data)
+    return received
+
+def receive_into(stream, fd, size, buffer_size):
+    buffer = memoryview(bytearray(buffer_size))
+    received = 0
+    while received < size:
+        count = stream.recv_into(buffer[:min(len(buffer), size - received)])
+        if not count:
+            break
+        os.pwrite(fd, buffer[:count], received)
+        received += count
+    return received
+
+RECEIVERS = {
+    'chunked': receive_chunked,
+    'recv_into': receive_into,
+}
+
+def run_transfer(sender, receiver, file_manager, filename, size, target, buffer_size, socket_buffer_size):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    set_socket_buffers(listener, send=socket_buffer_size)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+
+    def serve():
+        conn, _ = listener.accept()
+        try:
+            sender(file_manager, conn, filename, 0, size)
+        finally:
+            conn.close()
+
+    server_thread = threading.Thread(target=serve)
+    server_thread.start()
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    set_socket_buffers(client, receive=socket_buffer_size)
+    client.connect(('127.0.0.1', port))
+    fd = os.open(target, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    start = time.perf_counter()
+    received = receiver(MessageStream(client), fd, size, buffer_size)
+    elapsed = time.perf_counter() - start
+    os.close(fd)
+    client.close()
+    server_thread.join()
+    listener.close()
+
+    if received != size:
+        raise RuntimeError(f"Recebidos {received} de {size} bytes")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do envio de arquivos entre pares")
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', default=list(SENDERS), choices=list(SENDERS))
+    parser.add_argument('--receivers', nargs='+', default=list(RECEIVERS), choices=list(RECEIVERS))
+    parser.add_argument('--buffer-kb', type=int, default=RECV_BUFFER_SIZE // 1024,
+                        help="buffer de recepção do laço recv_into")
+    parser.add_argument('--socket-buffer-kb', type=int, default=SOCKET_BUFFER_SIZE // 1024,
+                        help="SO_RCVBUF/SO_SNDBUF pedidos (0 mantém o ajuste automático do kernel)")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as folder:
+        filename = 'bench.bin'
+        with open(os.path.join(folder, filename), 'wb') as f:
+            f.write(os.urandom(1024 * 1024) * args.size_mb)
+        target = os.path.join(folder, 'received.bin')
+
+        file_manager = FileManager(folder)
+        for mode in args.modes:
+            for receiver in args.receivers:
+                best = min(run_transfer(SENDERS[mode], RECEIVERS[receiver], file_manager, filename, size, target,
+                                        args.buffer_kb * 1024, args.socket_buffer_kb * 1024)
+                           for _ in range(args.repeat))
+                label = f"{mode}/{receiver}"
+                print(f"{label:>18}: {size / best / 1024 / 1024:10.1f} MiB/s ({best:.3f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from protocol import NapsterProtocol, FileTransferProtocol, MessageStream
+from napster_server import NapsterServer
+from async_server import AsyncNapsterServer
+from napster_client import NapsterClient
+from file_handler import FileManager
+from connection_pool import ConnectionPool
+from worker_pool import WorkerPool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WORDS = ['musica', 'video', 'foto', 'relatorio', 'backup', 'aula', 'projeto', 'show', 'live', 'mix']
+EXTENSIONS = ['mp3', 'mp4', 'jpg', 'pdf', 'zip', 'txt']
+DOWNLOAD_FILE = 'bench_download.bin'
+
+def free_port():
+    # Porta livre em todos os endereços: o par de arquivos escuta em '' e colidiria com
+    # conexões em TIME_WAIT de execuções anteriores saindo de outros IPs 127.0.x.y
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+
+def peer_address(index):
+    # Cada par simulado sai de um IP de loopback próprio (127.0.x.y), já que o servidor
+    # identifica os pares pelo IP
+    return f"127.0.{index // 250}.{index % 250 + 2}"
+
+def random_filename(rng, index):
+    return f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{index}.{rng.choice(EXTENSIONS)}"
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Operação desconhecida: {name}")
+        mix[name] = float(weight)
+    return mix
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def process_usage():
+    cpu = os.times()
+    usage = {'cpu_user_s': cpu.user, 'cpu_system_s': cpu.system}
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss vem em KiB no Linux e em bytes no macOS
+        usage['max_rss_mb'] = max_rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    return usage
+
+class SimulatedPeer:
+    def __init__(self, index, server_port, file_port, rng, files_per_peer):
+        self.index = index
+        self.ip_address = peer_address(index)
+        self.rng = rng
+        self.files_per_peer = files_per_peer
+        self.sock = socket.create_connection(('127.0.0.1', server_port), source_address=(self.ip_address, 0))
+        self.stream = MessageStream(self.sock)
+        self.pool = ConnectionPool(file_port)
+        self.shared = []
+        self.counter = 0
+
+    def command(self, command):
+        response = NapsterProtocol.send_command(self.stream, command)
+        if response is None or response.startswith(("ERROR", "BUSY")):
+            raise RuntimeError(f"{command.split()[0]}: {response}")
+        return response
+
+    def join(self):
+        self.command(f"JOIN bench{self.index}")
+
+    def register(self):
+        files = [(random_filename(self.rng, f"{self.index}_{i}"), self.rng.randint(1, 1 << 30))
+                 for i in range(self.files_per_peer)]
+        manifest = '\n'.join(f"{filename} {size}" for filename, size in files)
+        self.command(f"CREATEFILE_BULK {len(files)}\n{manifest}")
+        self.shared.extend(filename for filename, _ in files)
+
+    def create(self):
+        self.counter += 1
+        filename = random_filename(self.rng, f"{self.index}_n{self.counter}")
+        self.command(f"CREATEFILE {filename} {self.rng.randint(1, 1 << 30)}")
+        self.shared.append(filename)
+
+    def delete(self):
+        if not self.shared:
+            return self.create()
+        filename = self.shared.pop(self.rng.randrange(len(self.shared)))
+        self.command(f"DELETEFILE {filename}")
+
+    def search(self):
+        query = self.rng.choice(WORDS + [f"ext={extension}" for extension in EXTENSIONS])
+        self.stream.send_message(NapsterProtocol.format_search_command(query, 50, ranked=True))
+        while True:
+            frame = self.stream.read_message()
+            if frame is None or frame.startswith(("ERROR", "BUSY")):
+                raise RuntimeError(f"SEARCH: {frame}")
+            if frame.startswith("END"):
+                return
+
+    def download(self):
+        connection = self.pool.acquire('127.0.0.1')
+        reusable = False
+        try:
+            FileTransferProtocol.send_get_command(connection.stream, DOWNLOAD_FILE)
+            response = FileTransferProtocol.receive_response(connection.stream)
+            if not response.startswith("OK"):
+                raise RuntimeError(f"GET: {response}")
+            size = int(response.split()[1])
+            received = 0
+            buffer = memoryview(bytearray(256 * 1024))
+            while received < size:
+                count = connection.stream.recv_into(buffer[:min(len(buffer), size - received)])
+                if not count:
+                    raise RuntimeError("GET: conexão encerrada")
+                received += count
+            reusable = True
+            return received
+        finally:
+            self.pool.release(connection, reusable)
+
+    def close(self):
+        self.pool.close_all()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+OPERATIONS = {
+    'join': SimulatedPeer.join,
+    'create': SimulatedPeer.create,
+    'delete': SimulatedPeer.delete,
+    'search': SimulatedPeer.search,
+    'download': SimulatedPeer.download,
+}
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # operação -> [segundos]
+        self.errors = {}
+        self.bytes = 0
+
+    def measure(self, name, function, *args):
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except Exception:
+            with self.lock:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            return
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+            if name == 'download':
+                self.bytes += result
+
+    def report(self, elapsed):
+        results = {}
+        for name, values in sorted(self.latencies.items()):
+            results[name] = {
+                'count': len(values),
+                'errors': self.errors.get(name, 0),
+                'throughput_ops': len(values) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': max(values) * 1000,
+            }
+        for name, count in self.errors.items():
+            results.setdefault(name, {'count': 0, 'errors': count})
+        if 'download' in results and elapsed:
+            results['download']['throughput_mib_s'] = self.bytes / elapsed / 1024 / 1024
+        return results
+
+def run_phase(peers, work, threads):
+    # Reparte os pares entre as threads; cada thread usa só as conexões dos seus pares
+    start = time.perf_counter()
+    groups = [peers[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=work, args=(group,)) for group in groups if group]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+def start_server(engine, port):
+    server_class = AsyncNapsterServer if engine == 'asyncio' else NapsterServer
+    server = server_class('127.0.0.1', port)
+    server.leases.ttl = float('inf')
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Servidor não iniciou")
+
+def start_file_peer(folder, file_port, size):
+    with open(os.path.join(folder, DOWNLOAD_FILE), 'wb') as f:
+        f.write(os.urandom(size))
+    peer = NapsterClient('127.0.0.1', 0, file_port)
+    peer.file_manager = FileManager(folder)
+    # Todos os downloads saem de 127.0.0.1; o limite por IP padrão recusaria quase todos
+    peer.file_pool = WorkerPool(peer.handle_file_request, peer.reject_file_request,
+                                max_workers=64, max_queue=256, max_per_ip=320)
+    thread = threading.Thread(target=peer.start_file_server)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.2)
+    return peer
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o servidor Napster e o servidor de arquivos dos pares")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--peers', type=int, default=50)
+    parser.add_argument('--files-per-peer', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help="threads que disparam as operações")
+    parser.add_argument('--duration', type=float, default=10.0, help="segundos da fase mista")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("search=70,create=15,delete=10,join=3,download=2"))
+    parser.add_argument('--file-size-kb', type=int, default=1024, help="tamanho do arquivo baixado")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="grava os resultados em JSON neste caminho ('-' para a saída padrão)")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    # Servidor e par de arquivos imprimem cada conexão; só o relatório vai para a saída
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = run_benchmark(args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = out
+
+    print_report(results, out)
+    if args.json == '-':
+        json.dump(results, out, indent=2)
+        print(file=out)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+def run_benchmark(args):
+    server_port = free_port()
+    file_port = free_port()
+    server = start_server(args.engine, server_port)
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_peer = start_file_peer(folder, file_port, args.file_size_kb * 1024)
+        rng = random.Random(args.seed)
+        peers = [SimulatedPeer(i, server_port, file_port, random.Random(rng.random()), args.files_per_peer)
+                 for i in range(args.peers)]
+        usage_before = process_usage()
+
+        registration = Recorder()
+        def register(group):
+            for peer in group:
+                registration.measure('join', peer.join)
+                registration.measure('createfile_bulk', peer.register)
+        registration_elapsed = run_phase(peers, register, args.threads)
+
+        mixed = Recorder()
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        deadline = time.perf_counter() + args.duration
+        def mixed_load(group):
+            worker_rng = random.Random(group[0].index)
+            while time.perf_counter() < deadline:
+                peer = worker_rng.choice(group)
+                name = worker_rng.choices(names, weights)[0]
+                mixed.measure(name, OPERATIONS[name], peer)
+        mixed_elapsed = run_phase(peers, mixed_load, args.threads)
+        usage_after = process_usage()
+
+        for peer in peers:
+            peer.close()
+        file_peer.running = False
+        server.running = False
+
+    return {
+        'config': {key: value for key, value in vars(args).items() if key != 'json'},
+        'registration': {
+            'elapsed_s': registration_elapsed,
+            'files': args.peers * args.files_per_peer,
+            'files_per_s': args.peers * args.files_per_peer / registration_elapsed,
+            'operations': registration.report(registration_elapsed),
+        },
+        'mixed': {
+            'elapsed_s': mixed_elapsed,
+            'operations': mixed.report(mixed_elapsed),
+        },
+        # Servidor e pares simulados rodam no mesmo processo
+        'process': {
+            'cpu_user_s': usage_after['cpu_user_s'] - usage_before['cpu_user_s'],
+            'cpu_system_s': usage_after['cpu_system_s'] - usage_before['cpu_system_s'],
+            'max_rss_mb': usage_after.get('max_rss_mb'),
+        },
+    }
+
+def print_report(results, out):
+    registration = results['registration']
+    print(f"Registro: {registration['files']} arquivos em {registration['elapsed_s']:.2f}s "
+          f"({registration['files_per_s']:.0f} arquivos/s)", file=out)
+    # As duas fases medem JOIN; o prefixo separa as linhas de mesmo nome
+    for phase, label in (('registration', 'registro'), ('mixed', 'mistura')):
+        for name, stats in results[phase]['operations'].items():
+            name = f"{label}/{name}"
+            if not stats['count']:
+                print(f"{name:>24}: {stats['errors']} erros", file=out)
+                continue
+            print(f"{name:>24}: {stats['count']:7d} ops {stats['throughput_ops']:9.1f} ops/s "
+                  f"p50 {stats['p50_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms  erros {stats['errors']}", file=out)
+    process = results['process']
+    print(f"CPU: {process['cpu_user_s']:.2f}s usuário, {process['cpu_system_s']:.2f}s sistema; "
+          f"memória máxima: {process['max_rss_mb'] or 0:.1f} MiB", file=out)
+
+if __name__ == "__main__":
+    main()
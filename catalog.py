@@ -0,0 +1,254 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from search_index import NameIndex, SearchIndex
+
+class Sequence:
+    # itertools.count não é garantidamente atômico em builds sem GIL
+    def __init__(self):
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __next__(self):
+        with self.lock:
+            return next(self.counter)
+
+class CatalogShard:
+    def __init__(self, seq):
+        self.lock = threading.Lock()
+        self.files = {}  # ip -> {filename: file_info}
+        self.index = SearchIndex(seq)
+
+class HolderShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}          # (filename, size, hash) -> (seq, {ip: file_info})
+        self.index = NameIndex()  # nome em minúsculas -> {(filename, size, hash)}
+
+class Catalog:
+    def __init__(self, shard_count=16):
+        self.seq = Sequence()
+        self.shards = [CatalogShard(self.seq) for _ in range(shard_count)]
+        self.holder_shards = [HolderShard() for _ in range(shard_count)]
+        self.clients_lock = threading.Lock()
+        self.clients = {}       # socket -> {'ip_address', 'username'}
+        self.peer_clients = {}  # ip -> {socket}
+        self.handouts_lock = threading.Lock()
+        self.handouts = {}      # ip -> quantas vezes foi sugerido como fonte (com decaimento)
+        self.handout_half_life = 60.0
+        self.handouts_decay_at = time.monotonic() + self.handout_half_life
+
+    def shard_for(self, ip_address):
+        return self.shards[hash(ip_address) % len(self.shards)]
+
+    def holder_shard_for(self, filename):
+        return self.holder_shards[hash(filename) % len(self.holder_shards)]
+
+    def add_client(self, client_socket, ip_address, username):
+        with self.clients_lock:
+            self.clients[client_socket] = {'ip_address': ip_address, 'username': username}
+            self.peer_clients.setdefault(ip_address, set()).add(client_socket)
+
+        shard = self.shard_for(ip_address)
+        with shard.lock:
+            shard.files.setdefault(ip_address, {})
+            shard.index.add_peer(ip_address)
+
+    def add_files(self, ip_address, entries):
+        # Os grupos são atualizados sob o lock do shard do par, para que um remove_peer
+        # concorrente não deixe o par nos grupos. Ordem dos locks: par -> grupos
+        shard = self.shard_for(ip_address)
+        with shard.lock:
+            peer_files = shard.files.setdefault(ip_address, {})
+            for filename, size, content_hash in entries:
+                file_info = {
+                    'filename': filename,
+                    'size': size,
+                    'hash': content_hash
+                }
+                replaced = peer_files.pop(filename, None)
+                peer_files[filename] = file_info
+                shard.index.add(ip_address, filename, size, content_hash)
+                if replaced is not None:
+                    self.remove_holder(ip_address, replaced)
+                self.add_holder(ip_address, file_info)
+
+    def add_file(self, ip_address, filename, size, content_hash=None):
+        self.add_files(ip_address, [(filename, size, content_hash)])
+
+    def remove_file(self, ip_address, filename):
+        shard = self.shard_for(ip_address)
+        with shard.lock:
+            peer_files = shard.files.get(ip_address)
+            file_info = peer_files.pop(filename, None) if peer_files is not None else None
+            if file_info is None:
+                return False
+            shard.index.remove(ip_address, filename)
+            self.remove_holder(ip_address, file_info)
+        return True
+
+    def group_key(self, file_info):
+        return (file_info['filename'], file_info['size'], file_info['hash'])
+
+    def add_holder(self, ip_address, file_info):
+        key = self.group_key(file_info)
+        holder_shard = self.holder_shard_for(file_info['filename'])
+        with holder_shard.lock:
+            group = holder_shard.groups.get(key)
+            if group is None:
+                group = holder_shard.groups[key] = (next(self.seq), {})
+                holder_shard.index.add_name(file_info['filename'].lower(), key)
+            group[1][ip_address] = file_info
+
+    def remove_holder(self, ip_address, file_info):
+        key = self.group_key(file_info)
+        holder_shard = self.holder_shard_for(file_info['filename'])
+        with holder_shard.lock:
+            group = holder_shard.groups.get(key)
+            if group is not None:
+                group[1].pop(ip_address, None)
+                if not group[1]:
+                    del holder_shard.groups[key]
+                    holder_shard.index.discard_name(file_info['filename'].lower(), key)
+
+    def remove_peer(self, ip_address):
+        with self.clients_lock:
+            for client_socket in self.peer_clients.pop(ip_address, ()):
+                self.clients.pop(client_socket, None)
+        with self.handouts_lock:
+            self.handouts.pop(ip_address, None)
+
+        shard = self.shard_for(ip_address)
+        with shard.lock:
+            peer_files = shard.files.pop(ip_address, None)
+            if peer_files is None:
+                return None
+            shard.index.remove_peer(ip_address)
+            for file_info in peer_files.values():
+                self.remove_holder(ip_address, file_info)
+        return peer_files
+
+    def iter_search(self, query, after=None, small_result=1024):
+        # Intercala os shards na ordem global, puxando resultados sob demanda
+        per_shard = [self.shard_results(shard, query, after, small_result) for shard in self.shards]
+        return heapq.merge(*per_shard, key=lambda result: result[0])
+
+    def ranked_search(self, query, limit=None, after=None):
+        # Chave (-qualidade, -número de pares com o arquivo, ordem): menor é melhor e
+        # serve de cursor para a próxima página
+        holder_counts = {}
+        ranked = []
+        for order, row in self.iter_search(query):
+            filename = row[0]
+            if filename not in holder_counts:
+                holder_counts[filename] = self.holder_count(filename)
+            key = (-query.quality(filename.lower()), -holder_counts[filename]) + order
+            if after is None or key > after:
+                ranked.append((key, row))
+        if limit is None:
+            return sorted(ranked, key=lambda result: result[0])
+        return heapq.nsmallest(limit + 1, ranked, key=lambda result: result[0])
+
+    def shard_results(self, shard, query, after, small_result):
+        with shard.lock:
+            names = shard.index.match_query(query) if shard.index.is_indexed(query) else None
+            if names is not None and shard.index.match_count(names) <= small_result:
+                rows = shard.index.ordered_rows(names, after, query)
+                peers = None
+            else:
+                # Muitos resultados: percorre os pares na ordem, um por vez, para não
+                # materializar tudo nem segurar o lock enquanto o cliente consome
+                peers = shard.index.peer_order(after)
+        if peers is None:
+            yield from rows
+            return
+
+        names = set(names) if names is not None else None
+        for peer_seq, ip_address in peers:
+            with shard.lock:
+                rows = shard.index.peer_rows(ip_address, peer_seq, query, names, after)
+            yield from rows
+
+    def ranked_group_rows(self, query, limit=None, after=None):
+        ranked = []
+        for order, row in self.group_rows(query):
+            key = (-query.quality(row[0].lower()), -row[3]) + order
+            if after is None or key > after:
+                ranked.append((key, row))
+        if limit is None:
+            return sorted(ranked, key=lambda result: result[0])
+        return heapq.nsmallest(limit + 1, ranked, key=lambda result: result[0])
+
+    def group_rows(self, query, after=None):
+        # Um resultado por (arquivo, tamanho, hash), na ordem de criação do grupo, com
+        # a lista completa de pares; quem responde escolhe a amostra com sample_peers
+        per_shard = [self.shard_groups(holder_shard, query, after) for holder_shard in self.holder_shards]
+        return heapq.merge(*per_shard, key=lambda result: result[0])
+
+    def shard_groups(self, holder_shard, query, after):
+        results = []
+        with holder_shard.lock:
+            for name in holder_shard.index.match_query(query):
+                for key in holder_shard.index.names[name]:
+                    group_seq, holders = holder_shard.groups[key]
+                    if query.matches_size(key[1]) and (after is None or (group_seq,) > after):
+                        results.append(((group_seq,), key + (len(holders), list(holders))))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def sample_peers(self, holders, count):
+        # Duas vezes mais candidatos que o necessário, ficando com os menos sugeridos,
+        # para espalhar os downloads sem percorrer todos os pares de um arquivo popular
+        candidates = random.sample(holders, min(len(holders), count * 2))
+        with self.handouts_lock:
+            self.decay_handouts()
+            candidates.sort(key=lambda ip_address: self.handouts.get(ip_address, 0))
+            sample = candidates[:count]
+            for ip_address in sample:
+                self.handouts[ip_address] = self.handouts.get(ip_address, 0) + 1
+        return sample
+
+    def decay_handouts(self):
+        # Contagens só crescendo fariam de um par antigo, muito sugerido no passado, o
+        # último da fila para sempre. Dividir tudo pela metade a cada minuto faz o peso
+        # de uma sugestão cair com o tempo; contagens zeradas saem do dicionário
+        now = time.monotonic()
+        if now < self.handouts_decay_at:
+            return
+        self.handouts_decay_at = now + self.handout_half_life
+        self.handouts = {ip_address: count // 2 for ip_address, count in self.handouts.items() if count > 1}
+
+    def holder_count(self, filename):
+        holder_shard = self.holder_shard_for(filename)
+        with holder_shard.lock:
+            return sum(len(holder_shard.groups[key][1])
+                       for key in holder_shard.index.names.get(filename.lower(), ()) if key[0] == filename)
+
+    def peer_files(self, ip_address):
+        shard = self.shard_for(ip_address)
+        with shard.lock:
+            return dict(shard.files.get(ip_address, {}))
+
+    def counts(self):
+        peers = files = 0
+        for shard in self.shards:
+            with shard.lock:
+                peers += len(shard.files)
+                files += len(shard.index.entries)
+        return peers, files
+
+    def sessions(self, ip_address):
+        with self.clients_lock:
+            return list(self.peer_clients.get(ip_address, ()))
+
+    def export_peers(self):
+        # Cópia por shard, sem segurar mais de um lock por vez
+        for shard in self.shards:
+            with shard.lock:
+                peers = [(ip_address, [(filename, file_info['size'], file_info['hash'])
+                                       for filename, file_info in peer_files.items()])
+                         for ip_address, peer_files in shard.files.items()]
+            yield from peers
+
@@ -0,0 +1,203 @@
+import gc
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+SNAPSHOT_MAGIC = b"NAPSNAP1"
+HEADER = struct.Struct("!8sQI")  # magic, primeiro segmento de log a reaplicar, número de pares
+STRING = struct.Struct("!H")
+FILE_SIZE = struct.Struct("!Q")
+COUNT = struct.Struct("!I")
+
+def pack_string(text):
+    data = text.encode('utf-8')
+    return STRING.pack(len(data)) + data
+
+def unpack_string(view, offset):
+    (length,) = STRING.unpack_from(view, offset)
+    offset += STRING.size
+    return bytes(view[offset:offset + length]).decode('utf-8'), offset + length
+
+class CatalogStore:
+    # Snapshot binário compacto do catálogo + log de mutações em segmentos numerados.
+    # Ao fazer um snapshot, o log passa para um novo segmento antes de copiar o catálogo;
+    # na recuperação, o snapshot é carregado e os segmentos a partir do marcado nele são
+    # reaplicados (as operações são idempotentes, então repetir as já incluídas é seguro)
+    def __init__(self, folder="./server_data", snapshot_interval=300.0, fsync_interval=1.0):
+        self.folder = Path(folder)
+        self.snapshot_path = self.folder / "catalog.snapshot"
+        self.snapshot_interval = snapshot_interval
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.segment = 0
+        self.log_file = None
+        self.dirty = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def segment_path(self, segment):
+        return self.folder / f"catalog.{segment:08d}.log"
+
+    def segments(self):
+        found = []
+        for path in self.folder.glob("catalog.*.log"):
+            try:
+                found.append(int(path.name.split('.')[1]))
+            except ValueError:
+                continue
+        return sorted(found)
+
+    def load(self, catalog):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        started = time.monotonic()
+        first_segment = 0
+        peers = 0
+        operations = 0
+        # Milhões de objetos novos disparariam o coletor de ciclos o tempo todo; depois
+        # de carregar, eles vão para a geração permanente (gc.freeze)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if self.snapshot_path.exists():
+                first_segment, peers = self.load_snapshot(catalog)
+            for segment in self.segments():
+                if segment >= first_segment:
+                    operations += self.replay(catalog, self.segment_path(segment))
+        finally:
+            gc.freeze()
+            if gc_enabled:
+                gc.enable()
+
+        existing = self.segments()
+        self.open_segment(max(existing[-1] + 1 if existing else 0, first_segment))
+        if peers or operations:
+            print(f"Catálogo restaurado: {peers} pares do snapshot, {operations} operações do log "
+                  f"em {time.monotonic() - started:.2f}s")
+
+    def load_snapshot(self, catalog):
+        with open(self.snapshot_path, 'rb') as f:
+            view = memoryview(f.read())
+        magic, first_segment, peer_count = HEADER.unpack_from(view, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Snapshot inválido: {self.snapshot_path}")
+
+        offset = HEADER.size
+        for _ in range(peer_count):
+            ip_address, offset = unpack_string(view, offset)
+            (count,) = COUNT.unpack_from(view, offset)
+            offset += COUNT.size
+            entries = []
+            for _ in range(count):
+                filename, offset = unpack_string(view, offset)
+                (size,) = FILE_SIZE.unpack_from(view, offset)
+                content_hash, offset = unpack_string(view, offset + FILE_SIZE.size)
+                entries.append((filename, size, content_hash or None))
+            catalog.add_files(ip_address, entries)
+        return first_segment, peer_count
+
+    def replay(self, catalog, path):
+        operations = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # última linha cortada por uma queda no meio da escrita
+                parts = line.split()
+                if len(parts) == 5 and parts[0] == 'ADD':
+                    content_hash = parts[4] if parts[4] != '-' else None
+                    catalog.add_file(parts[1], parts[2], int(parts[3]), content_hash)
+                elif len(parts) == 3 and parts[0] == 'DEL':
+                    catalog.remove_file(parts[1], parts[2])
+                elif len(parts) == 2 and parts[0] == 'LEAVE':
+                    catalog.remove_peer(parts[1])
+                else:
+                    continue
+                operations += 1
+        return operations
+
+    def open_segment(self, segment):
+        if self.log_file is not None:
+            self.log_file.close()
+        self.segment = segment
+        self.log_file = open(self.segment_path(segment), 'a', encoding='utf-8')
+
+    def append(self, lines):
+        with self.lock:
+            if self.log_file is None:
+                return
+            self.log_file.write(''.join(lines))
+            self.log_file.flush()
+            self.dirty = True
+
+    def record_add(self, ip_address, entries):
+        self.append([f"ADD {ip_address} {filename} {size} {content_hash or '-'}\n"
+                     for filename, size, content_hash in entries])
+
+    def record_remove(self, ip_address, filename):
+        self.append([f"DEL {ip_address} {filename}\n"])
+
+    def record_leave(self, ip_address):
+        self.append([f"LEAVE {ip_address}\n"])
+
+    def snapshot(self, catalog):
+        with self.lock:
+            first_segment = self.segment + 1
+            self.open_segment(first_segment)
+
+        peers = [(ip_address, entries) for ip_address, entries in catalog.export_peers() if entries]
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, first_segment, len(peers)))
+            for ip_address, entries in peers:
+                chunk = [pack_string(ip_address), COUNT.pack(len(entries))]
+                for filename, size, content_hash in entries:
+                    chunk.append(pack_string(filename))
+                    chunk.append(FILE_SIZE.pack(size))
+                    chunk.append(pack_string(content_hash or ''))
+                f.write(b''.join(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        for segment in self.segments():
+            if segment < first_segment:
+                self.segment_path(segment).unlink(missing_ok=True)
+        return len(peers)
+
+    def sync(self):
+        with self.lock:
+            if self.log_file is None or not self.dirty:
+                return
+            os.fsync(self.log_file.fileno())
+            self.dirty = False
+
+    def start(self, catalog):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(catalog,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, catalog):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while not self.stop_event.wait(self.fsync_interval):
+            try:
+                self.sync()
+                if time.monotonic() >= next_snapshot:
+                    self.snapshot(catalog)
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+            except Exception as e:
+                print(f"Erro ao persistir o catálogo: {e}")
+
+    def close(self, catalog):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            self.snapshot(catalog)
+        except Exception as e:
+            print(f"Erro ao gravar o snapshot final: {e}")
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
@@ -1,10 +1,12 @@
 from napster_client import NapsterClient
+from log_setup import configure_logging
 import os
 import socket
 from pathlib import Path
 import threading
 
 def main():
+    configure_logging()
     client = NapsterClient()
     
     if not client.connect():
@@ -21,6 +23,8 @@ def main():
     file_server_thread = threading.Thread(target=client.start_file_server)
     file_server_thread.daemon = True
     file_server_thread.start()
+    client.start_share_watcher()
+    client.start_heartbeat()
     
     while True:
         print("\n=== MENU ===")
@@ -37,7 +41,7 @@ def main():
         elif choice == '2':
             client.search_files("")  
         elif choice == '3':
-            query = input("Digite o termo de busca: ").strip()
+            query = input("Digite o termo de busca (filtros opcionais: ext=mp3,txt min=1M max=10M): ").strip()
             if query:
                 client.search_files(query)
         elif choice == '4':
@@ -307,7 +311,7 @@ if __name__ == "__main__":
                 self.list_all_files()
             
             elif choice == '3':
-                query = input("Digite o termo de busca: ").strip()
+                query = input("Digite o termo de busca (filtros opcionais: ext=mp3,txt min=1M max=10M): ").strip()
                 if query:
                     self.search_files(query)
             
@@ -0,0 +1,83 @@
+import socket
+import threading
+import time
+from protocol import MessageStream, set_socket_buffers, wait_readable, SOCKET_BUFFER_SIZE
+
+class PeerConnection:
+    def __init__(self, ip_address, port, timeout, socket_buffer_size=SOCKET_BUFFER_SIZE):
+        self.ip_address = ip_address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        set_socket_buffers(self.sock, receive=socket_buffer_size)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect((ip_address, port))
+        except OSError:
+            self.sock.close()
+            raise
+        self.stream = MessageStream(self.sock)
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        # Uma conexão ociosa saudável não tem nada para ler; legível significa EOF ou lixo
+        try:
+            return not wait_readable(self.sock, 0) and not self.stream.buffer
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    def __init__(self, port, max_idle_per_peer=4, idle_timeout=30.0, timeout=30.0,
+                 socket_buffer_size=SOCKET_BUFFER_SIZE):
+        self.port = port
+        self.socket_buffer_size = socket_buffer_size
+        self.max_idle_per_peer = max_idle_per_peer
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = {}  # ip -> [PeerConnection]
+        self.lock = threading.Lock()
+
+    def acquire(self, ip_address):
+        with self.lock:
+            self.evict_idle()
+            connections = self.idle.get(ip_address)
+            while connections:
+                connection = connections.pop()
+                if connection.is_alive():
+                    return connection
+                connection.close()
+        return PeerConnection(ip_address, self.port, self.timeout, self.socket_buffer_size)
+
+    def release(self, connection, reusable=True):
+        if not reusable:
+            connection.close()
+            return
+        connection.last_used = time.monotonic()
+        with self.lock:
+            connections = self.idle.setdefault(connection.ip_address, [])
+            if len(connections) >= self.max_idle_per_peer:
+                connection.close()
+            else:
+                connections.append(connection)
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for ip_address in list(self.idle):
+            connections = self.idle[ip_address]
+            for connection in connections:
+                if connection.last_used < deadline:
+                    connection.close()
+            connections[:] = [connection for connection in connections if connection.last_used >= deadline]
+            if not connections:
+                del self.idle[ip_address]
+
+    def close_all(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
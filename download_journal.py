@@ -0,0 +1,92 @@
+import bisect
+import json
+import os
+from pathlib import Path
+
+class DownloadJournal:
+    def __init__(self, file_path, checkpoint_bytes=4 * 1024 * 1024):
+        self.file_path = Path(file_path)
+        self.path = self.file_path.with_name(self.file_path.name + '.journal')
+        self.checkpoint_bytes = checkpoint_bytes
+        self.size = None
+        self.content_hash = None  # versão do arquivo a que os intervalos pertencem
+        self.ranges = []  # intervalos [início, fim) já gravados, ordenados e sem sobreposição
+        self.unsaved_bytes = 0
+        self.load()
+
+    def load(self):
+        if not self.path.exists() or not self.file_path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self.size = int(data['size'])
+            self.content_hash = data.get('hash')
+            self.ranges = [(int(start), int(end)) for start, end in data['ranges']]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.size = None
+            self.content_hash = None
+            self.ranges = []
+
+    def start(self, size, content_hash=None):
+        # Outro tamanho ou outro conteúdo: o que já está no disco é de outra versão
+        if self.size != size or self.content_hash != content_hash:
+            self.size = size
+            self.content_hash = content_hash
+            self.ranges = []
+            if size is None:
+                self.finish()
+            else:
+                self.save()
+
+    def add(self, start, end, fd=None):
+        self.unsaved_bytes += end - start
+        index = bisect.bisect_left(self.ranges, (start, end))
+        if index > 0 and self.ranges[index - 1][1] >= start:
+            index -= 1
+            start = min(start, self.ranges[index][0])
+        last = index
+        while last < len(self.ranges) and self.ranges[last][0] <= end:
+            end = max(end, self.ranges[last][1])
+            last += 1
+        self.ranges[index:last] = [(start, end)]
+
+        if self.unsaved_bytes >= self.checkpoint_bytes:
+            self.save(fd)
+
+    def save(self, fd=None):
+        if self.size is None:
+            return
+        if fd is not None:
+            # Só registra como concluído o que já está de fato no disco
+            os.fsync(fd)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps({'size': self.size, 'hash': self.content_hash, 'ranges': self.ranges}))
+        os.replace(tmp_path, self.path)
+        self.unsaved_bytes = 0
+
+    def missing(self, start=0, end=None):
+        # Lacunas dentro de [start, end); sem end, até o fim do arquivo
+        end = self.size if end is None else end
+        gaps = []
+        position = start
+        for range_start, range_end in self.ranges:
+            if range_end <= position:
+                continue
+            if end is not None and range_start >= end:
+                break
+            if range_start > position:
+                gaps.append((position, range_start))
+            position = max(position, range_end)
+        if end is not None and position < end:
+            gaps.append((position, end))
+        return gaps
+
+    def missing_bytes(self, start=0, end=None):
+        return sum(gap_end - gap_start for gap_start, gap_end in self.missing(start, end))
+
+    def is_complete(self):
+        return self.size is not None and not self.missing()
+
+    def finish(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -1,10 +1,61 @@
+import collections
+import errno
+import multiprocessing
 import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from stat import S_ISREG
+from hashing import hash_file, PIECE_SIZE
+from protocol import encode_frame, wait_writable
+
+# Formatos que já vêm comprimidos: recomprimir só gasta CPU
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.avi', '.bz2', '.docx', '.flac', '.gif', '.gz', '.jar', '.jpeg', '.jpg', '.m4a',
+    '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp',
+    '.xlsx', '.xz', '.zip', '.zst',
+}
+
+def preallocate(fd, size):
+    # Reserva os blocos do arquivo final de uma vez: menos fragmentação, e a falta de
+    # espaço aparece no início do download. Sem posix_fallocate, só ajusta o tamanho
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+class ServedFile:
+    # Entrada do manifesto de arquivos servidos: caminho, tamanho e mtime vistos no último
+    # scan, e o arquivo aberto quando está no cache de descritores
+    def __init__(self, key, path, size, mtime):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.file = None
+        self.users = 0        # envios usando o descritor agora
+        self.cached = False   # descritor está no LRU
+        self.stale = False    # o scan viu o arquivo mudar ou sumir
 
 class FileManager:
     
-    def __init__(self, shared_folder="./public"):
+    def __init__(self, shared_folder="./public", hash_workers=None):
         self.shared_folder = shared_folder
+        self.hash_workers = hash_workers
+        self.hash_cache = {}  # caminho -> (mtime_ns, tamanho, hash, hashes das peças)
+        # GETs consultam o manifesto em memória em vez de exists/is_file/stat/open a cada
+        # pedido; cada scan (inclusive os do monitor da pasta) o reconstrói
+        self.manifest = {}  # caminho relativo -> ServedFile
+        self.open_files = collections.OrderedDict()  # caminho relativo -> ServedFile aberto (LRU)
+        self.max_open_files = 64
+        self.manifest_lock = threading.Lock()
+        self.folder_cache = {}  # pasta -> (mtime_ns, file_infos, subpastas) do último scan
+        self.hash_pool = None
+        self.hash_pool_lock = threading.Lock()
         self.setup_folders()
     
     def setup_folders(self):
@@ -17,32 +68,230 @@ class FileManager:
     def scan_files(self):
         files = []
         try:
-            for file_path in Path(self.shared_folder).rglob('*'):
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    file_info = {
-                        "name": file_path.name,
-                        "size": stat.st_size,
-                        "path": str(file_path.relative_to(self.shared_folder)),
-                        "extension": file_path.suffix
-                    }
-                    files.append(file_info)
+            files = self.walk_files()
+            self.hash_files(files)
         except Exception as e:
             print(f"Erro ao escanear arquivos: {e}")
         
         return files
     
+    def walk_files(self, full=False):
+        # os.scandir evita o custo de rglob + is_file + stat separados por arquivo. Criar,
+        # apagar ou renomear um arquivo muda o mtime da pasta, então pastas com o mesmo mtime
+        # do último scan reaproveitam a listagem anterior sem stat dos arquivos. Editar um
+        # arquivo no lugar não muda a pasta: full=True refaz a varredura inteira
+        files = []
+        folder_cache = {}
+        rescanned = full or not self.folder_cache
+        # Pastas alteradas há menos de 2 s podem mudar de novo com o mesmo mtime: não entram no cache
+        recent = time.time_ns() - 2 * 10 ** 9
+        folders = [self.shared_folder]
+        while folders:
+            folder = folders.pop()
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                rescanned = True
+                continue
+            cached = None if full else self.folder_cache.get(folder)
+            if cached is not None and cached[0] == mtime:
+                _, folder_files, subfolders = cached
+            else:
+                rescanned = True
+                folder_files, subfolders = self.scan_folder(folder)
+            if mtime < recent:
+                folder_cache[folder] = (mtime, folder_files, subfolders)
+            files.extend(folder_files)
+            folders.extend(subfolders)
+        self.folder_cache = folder_cache
+        if rescanned:
+            self.update_manifest(files)
+        return files
+    
+    def scan_folder(self, folder):
+        folder_files = []
+        subfolders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    folder_files.append({
+                        "name": entry.name,
+                        "size": stat.st_size,
+                        "path": os.path.relpath(entry.path, self.shared_folder),
+                        "extension": os.path.splitext(entry.name)[1],
+                        "mtime": stat.st_mtime_ns
+                    })
+        return folder_files, subfolders
+    
+    def update_manifest(self, files):
+        # O scan é a referência: entradas iguais (mesmo tamanho e mtime) são mantidas com o
+        # descritor aberto; as que mudaram ou sumiram são descartadas
+        with self.manifest_lock:
+            manifest = {}
+            for file_info in files:
+                entry = self.manifest.get(file_info['path'])
+                if entry is None or entry.size != file_info['size'] or entry.mtime != file_info['mtime']:
+                    entry = ServedFile(file_info['path'], str(Path(self.shared_folder) / file_info['path']),
+                                       file_info['size'], file_info['mtime'])
+                manifest[file_info['path']] = entry
+            for key, entry in self.manifest.items():
+                if manifest.get(key) is not entry:
+                    self.discard(entry)
+            self.manifest = manifest
+    
+    def discard(self, entry):
+        entry.stale = True
+        if entry.cached:
+            del self.open_files[entry.key]
+            entry.cached = False
+        if entry.users == 0 and entry.file is not None:
+            entry.file.close()
+            entry.file = None
+    
+    def forget(self, filename):
+        # Entrada desatualizada (ex.: o arquivo encolheu): a próxima consulta vai ao disco
+        with self.manifest_lock:
+            entry = self.manifest.pop(filename, None)
+            if entry is not None:
+                self.discard(entry)
+    
+    def lookup(self, filename):
+        with self.manifest_lock:
+            entry = self.manifest.get(filename)
+        if entry is not None:
+            return entry
+        # Fora do manifesto (antes do primeiro scan ou criado depois do último): consulta o
+        # disco e guarda o resultado até o próximo scan
+        file_path = self.get_file_path(filename)
+        try:
+            stat = file_path.stat()
+        except (OSError, ValueError):
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        with self.manifest_lock:
+            return self.manifest.setdefault(filename, ServedFile(filename, str(file_path), stat.st_size,
+                                                                  stat.st_mtime_ns))
+    
+    def checkout(self, filename):
+        # Arquivo aberto para envio, vindo do LRU de descritores; devolva com checkin
+        entry = self.open_entry(filename)
+        # Fora do scan completo (a cada 5 minutos), uma edição no lugar não muda o mtime da
+        # pasta e a entrada seguiria com tamanho e hashes antigos. Um fstat no descritor já
+        # aberto confirma a entrada; se mudou, ela sai do manifesto e o disco é consultado
+        stat = os.fstat(entry.file.fileno())
+        if stat.st_size != entry.size or stat.st_mtime_ns != entry.mtime:
+            self.checkin(entry)
+            self.forget(filename)
+            entry = self.open_entry(filename)
+        return entry
+    
+    def open_entry(self, filename):
+        entry = self.lookup(filename)
+        if entry is None:
+            raise FileNotFoundError(filename)
+        with self.manifest_lock:
+            if entry.file is None:
+                entry.file = open(entry.path, 'rb', buffering=0)
+            if entry.cached:
+                self.open_files.move_to_end(entry.key)
+            elif not entry.stale:
+                self.open_files[entry.key] = entry
+                entry.cached = True
+                while len(self.open_files) > self.max_open_files:
+                    _, oldest = self.open_files.popitem(last=False)
+                    oldest.cached = False
+                    if oldest.users == 0:
+                        oldest.file.close()
+                        oldest.file = None
+            entry.users += 1
+        return entry
+    
+    def checkin(self, entry):
+        with self.manifest_lock:
+            entry.users -= 1
+            if entry.users == 0 and not entry.cached and entry.file is not None:
+                entry.file.close()
+                entry.file = None
+    
+    def close_files(self):
+        with self.manifest_lock:
+            for entry in list(self.open_files.values()):
+                self.discard(entry)
+    
+    def get_hash_pool(self):
+        # Um pool só para toda a vida do cliente: subir processos a cada scan do monitor
+        # custaria mais que o hash dos poucos arquivos novos. O cliente já tem threads
+        # rodando (heartbeat, monitor, servidor de arquivos), e um fork herdaria locks
+        # que elas seguravam; forkserver/spawn partem de um processo limpo
+        with self.hash_pool_lock:
+            if self.hash_pool is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.hash_pool = ProcessPoolExecutor(max_workers=self.hash_workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            return self.hash_pool
+    
+    def close_hash_pool(self):
+        with self.hash_pool_lock:
+            if self.hash_pool is not None:
+                self.hash_pool.shutdown()
+                self.hash_pool = None
+    
+    def hash_files(self, files):
+        missing = [file_info for file_info in files if self.cached_hash(file_info) is None]
+        if len(missing) > 1:
+            paths = [str(Path(self.shared_folder) / file_info['path']) for file_info in missing]
+            results = list(self.get_hash_pool().map(hash_file, paths, chunksize=16))
+        else:
+            results = [hash_file(Path(self.shared_folder) / file_info['path']) for file_info in missing]
+        
+        for file_info, (content_hash, piece_hashes) in zip(missing, results):
+            self.store_hash(file_info, content_hash, piece_hashes)
+        
+        for file_info in files:
+            file_info['hash'] = self.cached_hash(file_info)[0]
+    
+    def store_hash(self, file_info, content_hash, piece_hashes):
+        key = str(Path(self.shared_folder) / file_info['path'])
+        self.hash_cache[key] = (file_info['mtime'], file_info['size'], content_hash, piece_hashes)
+    
+    def cached_hash(self, file_info):
+        key = str(Path(self.shared_folder) / file_info['path'])
+        cached = self.hash_cache.get(key)
+        if cached and cached[0] == file_info['mtime'] and cached[1] == file_info['size']:
+            return cached[2], cached[3]
+        return None
+    
+    def get_hashes(self, filename):
+        entry = self.checkout(filename)
+        self.checkin(entry)
+        file_info = {
+            "path": filename,
+            "size": entry.size,
+            "mtime": entry.mtime
+        }
+        hashes = self.cached_hash(file_info)
+        if hashes is None:
+            self.hash_files([file_info])
+            hashes = self.cached_hash(file_info)
+        return PIECE_SIZE, entry.size, hashes[0], hashes[1]
+    
     def get_file_path(self, filename):
         return Path(self.shared_folder) / filename
     
     def file_exists(self, filename):
-        file_path = self.get_file_path(filename)
-        return file_path.exists() and file_path.is_file()
+        return self.lookup(filename) is not None
     
     def get_file_size(self, filename):
-        if self.file_exists(filename):
-            return self.get_file_path(filename).stat().st_size
-        return 0
+        try:
+            entry = self.checkout(filename)
+        except OSError:
+            return 0
+        self.checkin(entry)
+        return entry.size
     
     def read_file_chunk(self, filename, offset_start, bytes_to_read):
         file_path = self.get_file_path(filename)
@@ -50,6 +299,88 @@ class FileManager:
             f.seek(offset_start)
             return f.read(bytes_to_read)
     
+    def send_file_range(self, sock, filename, offset_start, bytes_to_send, throttle=None, chunk_size=64 * 1024):
+        # O descritor é compartilhado entre conexões, então tudo sai de posições explícitas:
+        # os.sendfile (zero-cópia) quando existe e o kernel aceita o arquivo, senão pread +
+        # sendall. socket.sendfile não serve, porque sua alternativa faz seek + read no
+        # arquivo compartilhado. Com limite de banda, o intervalo sai em blocos e `throttle`
+        # libera cada um. Devolve os bytes enviados: menos que o pedido se o arquivo
+        # encolheu desde o último scan
+        entry = self.checkout(filename)
+        try:
+            fd = entry.file.fileno()
+            use_sendfile = hasattr(os, 'sendfile')
+            sent = 0
+            while sent < bytes_to_send:
+                count = bytes_to_send - sent
+                if throttle is not None:
+                    count = min(chunk_size, count)
+                    throttle(count)
+                written = None
+                if use_sendfile:
+                    try:
+                        written = self.sendfile_block(sock, fd, offset_start + sent, count)
+                    except OSError as e:
+                        if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                            raise
+                        use_sendfile = False
+                if written is None:
+                    data = os.pread(fd, min(count, chunk_size), offset_start + sent)
+                    sock.sendall(data)
+                    written = len(data)
+                if not written:
+                    break
+                sent += written
+            return sent
+        finally:
+            self.checkin(entry)
+    
+    def sendfile_block(self, sock, fd, offset, count):
+        # Sockets com timeout são não bloqueantes por baixo: espera o buffer de envio abrir
+        while True:
+            try:
+                return os.sendfile(sock.fileno(), fd, offset, count)
+            except BlockingIOError:
+                if not wait_writable(sock, sock.gettimeout()):
+                    raise socket.timeout("timed out")
+    
+    def is_compressible(self, filename):
+        # Mesma extensão que walk_files registra para os arquivos compartilhados
+        return os.path.splitext(filename)[1].lower() not in COMPRESSED_EXTENSIONS
+    
+    def send_compressed_range(self, sock, filename, offset_start, bytes_to_send, compressor, chunk_size=256 * 1024,
+                              throttle=None):
+        # Comprime o intervalo bloco a bloco e envia cada saída não vazia como um quadro
+        # "<tamanho>\n<dados>"; um quadro vazio marca o fim. Devolve os bytes comprimidos
+        sent = 0
+        entry = self.checkout(filename)
+        try:
+            # O descritor é compartilhado entre conexões: pread não mexe na posição do arquivo
+            position = offset_start
+            remaining = bytes_to_send
+            while remaining:
+                data = os.pread(entry.file.fileno(), min(chunk_size, remaining), position)
+                if not data:
+                    break
+                position += len(data)
+                remaining -= len(data)
+                compressed = compressor.compress(data)
+                if compressed:
+                    if throttle is not None:
+                        throttle(len(compressed))
+                    sock.sendall(encode_frame(compressed))
+                    sent += len(compressed)
+        finally:
+            self.checkin(entry)
+        compressed = compressor.flush()
+        if compressed:
+            if throttle is not None:
+                throttle(len(compressed))
+            sock.sendall(encode_frame(compressed))
+            sent += len(compressed)
+        sock.sendall(encode_frame(b''))
+        return sent
+    
     def write_file(self, filename, data, folder="./downloads"):
         if not os.path.exists(folder):
             os.makedirs(folder)
@@ -63,3 +394,9 @@ class FileManager:
             os.makedirs(folder)
         file_path = Path(folder) / filename
         return open(file_path, 'wb')
+
+    def open_for_positional_write(self, filename, folder="./downloads"):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        file_path = Path(folder) / filename
+        return file_path, os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import hashlib
+
+PIECE_SIZE = 1024 * 1024
+
+def hash_file(path, piece_size=PIECE_SIZE):
+    piece_hashes = []
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(piece_size)
+            if not data:
+                break
+            piece_hashes.append(hashlib.sha256(data).hexdigest())
+    return root_hash(piece_hashes), piece_hashes
+
+def root_hash(piece_hashes):
+    # Lista de hashes das peças: o hash do conteúdo é o SHA-256 da concatenação delas
+    digest = hashlib.sha256()
+    for piece_hash in piece_hashes:
+        digest.update(bytes.fromhex(piece_hash))
+    return digest.hexdigest()
+
+def manifest_hash(entries):
+    # Resumo do que um par compartilha: (nome, tamanho, hash) ordenados por nome
+    digest = hashlib.sha256()
+    for filename, size, content_hash in sorted(entries):
+        digest.update(f"{filename} {size} {content_hash or '-'}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+class PieceVerifier:
+    def __init__(self, size, piece_hashes, piece_size=PIECE_SIZE):
+        self.size = size
+        self.piece_hashes = piece_hashes
+        self.piece_size = piece_size
+
+    def align(self, start, end):
+        start -= start % self.piece_size
+        end = min(-(-end // self.piece_size) * self.piece_size, self.size)
+        return start, end
+
+    def stream(self, position):
+        return PieceStream(self, position)
+
+class PieceStream:
+    def __init__(self, verifier, position):
+        if position % verifier.piece_size:
+            raise ValueError("O fluxo precisa começar no início de uma peça")
+        self.verifier = verifier
+        self.piece_start = position
+        self.position = position
+        self.digest = hashlib.sha256()
+
+    def update(self, data):
+        # Devolve (início, fim, ok) para cada peça completada por este bloco
+        completed = []
+        view = memoryview(data)
+        while view:
+            piece_end = min(self.piece_start + self.verifier.piece_size, self.verifier.size)
+            take = min(len(view), piece_end - self.position)
+            self.digest.update(view[:take])
+            self.position += take
+            view = view[take:]
+            if self.position == piece_end:
+                index = self.piece_start // self.verifier.piece_size
+                ok = (index < len(self.verifier.piece_hashes)
+                      and self.digest.hexdigest() == self.verifier.piece_hashes[index])
+                completed.append((self.piece_start, piece_end, ok))
+                self.piece_start = piece_end
+                self.digest = hashlib.sha256()
+            if take == 0:
+                break
+        return completed
@@ -0,0 +1,42 @@
+import heapq
+import threading
+import time
+
+class LeaseTable:
+    # Cada par tem um prazo renovado a cada comando ou HEARTBEAT. O heap guarda no
+    # máximo uma entrada por par: renovar só atualiza o prazo no dicionário, e quando a
+    # entrada antiga chega ao topo ela é reagendada com o prazo atual. Assim, expirar
+    # custa O(expirados + reagendados) e renovar é O(1)
+    def __init__(self, ttl=90.0):
+        self.ttl = ttl
+        self.deadlines = {}  # ip -> prazo (time.monotonic)
+        self.heap = []       # (prazo agendado, ip)
+        self.lock = threading.Lock()
+
+    def renew(self, ip_address, now=None):
+        deadline = (now if now is not None else time.monotonic()) + self.ttl
+        with self.lock:
+            if ip_address not in self.deadlines:
+                heapq.heappush(self.heap, (deadline, ip_address))
+            self.deadlines[ip_address] = deadline
+
+    def remove(self, ip_address):
+        # A entrada no heap fica para trás e é descartada quando chegar ao topo
+        with self.lock:
+            self.deadlines.pop(ip_address, None)
+
+    def expire(self, now=None):
+        now = now if now is not None else time.monotonic()
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, ip_address = heapq.heappop(self.heap)
+                deadline = self.deadlines.get(ip_address)
+                if deadline is None:
+                    continue
+                if deadline > now:
+                    heapq.heappush(self.heap, (deadline, ip_address))
+                else:
+                    del self.deadlines[ip_address]
+                    expired.append(ip_address)
+        return expired
@@ -0,0 +1,46 @@
+import logging
+import os
+import threading
+import time
+
+class RateLimitFilter(logging.Filter):
+    # Deixa passar no máximo `burst` mensagens por modelo (logger + texto antes da
+    # formatação) a cada `interval` segundos; as demais são contadas e resumidas na
+    # primeira mensagem da janela seguinte
+    def __init__(self, burst=10, interval=1.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}  # (logger, modelo) -> [início da janela, emitidas, suprimidas]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self.windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} mensagens semelhantes suprimidas)"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+def configure_logging(level=None, burst=10, interval=1.0):
+    # Nível vem do argumento ou de NAPSTER_LOG_LEVEL (DEBUG, INFO, WARNING...); padrão INFO
+    level = level or os.environ.get('NAPSTER_LOG_LEVEL', 'INFO')
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S"))
+    handler.addFilter(RateLimitFilter(burst, interval))
+    logger = logging.getLogger('napster')
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return logger
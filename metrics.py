@@ -0,0 +1,72 @@
+import bisect
+import threading
+
+# Limites dos baldes de latência, em segundos
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # o último balde recebe o que passar do maior limite
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction):
+        # Estimativa pelo limite superior do balde em que cai o quantil
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+class Metrics:
+    # Contadores, histogramas e medidores calculados na hora da leitura. Incrementar é
+    # uma soma sob um lock, barato o bastante para o caminho de cada comando
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # nome -> função sem argumentos
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        with self.lock:
+            values = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                values[f"{name}.count"] = histogram.count
+                values[f"{name}.sum"] = round(histogram.total, 6)
+                values[f"{name}.p50"] = histogram.quantile(0.50)
+                values[f"{name}.p99"] = histogram.quantile(0.99)
+        for name, function in list(self.gauges.items()):
+            try:
+                values[name] = function()
+            except Exception:
+                values[name] = None
+        return dict(sorted(values.items()))
+
+    def format(self):
+        # Uma métrica por linha: "<nome> <valor>"
+        return '\n'.join(f"{name} {value}" for name, value in self.snapshot().items())
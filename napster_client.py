@@ -1,8 +1,22 @@
+import logging
+import os
 import socket
 import threading
+import time
 from pathlib import Path
-from protocol import NapsterProtocol, FileTransferProtocol
-from file_handler import FileManager
+from protocol import (NapsterProtocol, FileTransferProtocol, MessageStream, set_socket_buffers, RECV_BUFFER_SIZE,
+                      SOCKET_BUFFER_SIZE, COMPRESSION_CODECS, parse_size, wait_readable)
+from file_handler import FileManager, preallocate
+from swarm import SwarmDownload
+from download_journal import DownloadJournal
+from hashing import PieceVerifier, root_hash, manifest_hash
+from share_watcher import ShareWatcher
+from connection_pool import ConnectionPool
+from metrics import Metrics
+from worker_pool import WorkerPool
+from rate_limiter import UploadLimiter
+
+logger = logging.getLogger('napster.client')
 
 class NapsterClient:
     def __init__(self, server_host='localhost', server_port=1234, file_port=1235):
@@ -10,15 +24,48 @@ class NapsterClient:
         self.server_port = server_port
         self.file_port = file_port
         self.socket = None
+        self.stream = None
         self.username = None
         self.file_manager = FileManager()
+        self.share_watcher = ShareWatcher(self.file_manager)
+        self.files_registered = False
+        self.command_lock = threading.Lock()
         self.file_server_socket = None
+        self.file_idle_timeout = 60.0
+        self.file_backlog = 64
+        self.receive_buffer_size = RECV_BUFFER_SIZE
+        self.socket_buffer_size = SOCKET_BUFFER_SIZE
+        # Compressões oferecidas nos GET (ex.: NAPSTER_COMPRESSION=zlib ou lzma,zlib); vale a
+        # pena em redes lentas, já que em rede local rápida a CPU vira o gargalo
+        self.compression = tuple(name for name in os.environ.get('NAPSTER_COMPRESSION', '').split(',')
+                                 if name in COMPRESSION_CODECS)
+        self.min_compress_size = 4096
+        # Limites de envio em bytes/s (ex.: NAPSTER_UPLOAD_RATE=2M): o global é dividido em
+        # rodízio entre os IPs que baixam; sem eles, os envios não são limitados
+        upload_rate = os.environ.get('NAPSTER_UPLOAD_RATE')
+        connection_rate = os.environ.get('NAPSTER_UPLOAD_RATE_PER_CONNECTION')
+        self.upload_limiter = UploadLimiter(parse_size(upload_rate) if upload_rate else None,
+                                            parse_size(connection_rate) if connection_rate else None)
+        # Downloads simultâneos de outros pares ficam limitados para não esgotar memória
+        # nem competir com a interface; quem passa do limite recebe BUSY
+        self.file_pool = WorkerPool(self.handle_file_request, self.reject_file_request,
+                                    max_workers=16, max_queue=32, max_per_ip=4, queue_timeout=5.0)
+        self.connection_pool = ConnectionPool(file_port, socket_buffer_size=self.socket_buffer_size)
+        self.heartbeat_interval = 30.0
+        self.heartbeat_stop = threading.Event()
+        self.metrics = Metrics()
+        self.metrics.gauge('threads', threading.active_count)
+        self.metrics.gauge('file_server.workers', lambda: self.file_pool.workers)
+        self.metrics.gauge('file_server.queued', self.file_pool.queued)
+        self.metrics.gauge('file_server.upload_waiting', lambda: self.upload_limiter.pending())
+        self.metrics.gauge('file_server.upload_throttled_s', lambda: round(self.upload_limiter.waited, 3))
         self.running = True
         
     def connect(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.server_host, self.server_port))
+            self.stream = MessageStream(self.socket)
             print(f"Conectado ao servidor {self.server_host}:{self.server_port}")
             return True
         except Exception as e:
@@ -27,93 +74,234 @@ class NapsterClient:
     
     def disconnect(self):
         self.running = False
+        self.heartbeat_stop.set()
+        self.share_watcher.stop()
         if self.socket:
             try:
-                response = NapsterProtocol.send_command(self.socket, "LEAVE")
+                response = self.send_command("LEAVE")
                 if response == "CONFIRMLEAVE":
                     print("Desconexão confirmada pelo servidor")
             except:
                 pass
             self.socket.close()
             print("Desconectado do servidor")
+        self.connection_pool.close_all()
+        self.file_manager.close_files()
+        self.file_manager.close_hash_pool()
         if self.file_server_socket:
             self.file_server_socket.close()
             print("Servidor de arquivos encerrado")
     
+    def start_heartbeat(self):
+        # Mantém o prazo do par no servidor; sem isso ele é removido após ~90 s
+        self.heartbeat_stop.clear()
+        thread = threading.Thread(target=self.send_heartbeats)
+        thread.daemon = True
+        thread.start()
+        return thread
+    
+    def send_heartbeats(self):
+        while not self.heartbeat_stop.wait(self.heartbeat_interval):
+            response = self.send_command("HEARTBEAT")
+            if response == "CONFIRMHEARTBEAT" or self.heartbeat_stop.is_set():
+                continue
+            print(f"Servidor não confirmou o heartbeat ({response}); registrando novamente")
+            try:
+                self.rejoin()
+            except Exception as e:
+                print(f"Erro ao reconectar: {e}")
+    
+    def rejoin(self):
+        with self.command_lock:
+            if self.socket:
+                try:
+                    self.socket.close()
+                except OSError:
+                    pass
+            connected = self.connect()
+        if connected and self.username:
+            self.files_registered = False
+            self.join_server(self.username)
+    
     def send_command(self, command):
-        try:
-            self.socket.send(f"{command}\n".encode('utf-8'))
-            response = self.socket.recv(4096).decode('utf-8').strip()
-            return response
-        except Exception as e:
-            print(f"Erro na comunicação: {e}")
-            return None
+        # O monitor da pasta compartilhada usa o mesmo socket em outra thread
+        with self.command_lock:
+            return NapsterProtocol.send_command(self.stream, command)
+    
+    def send_commands(self, commands):
+        with self.command_lock:
+            return NapsterProtocol.send_commands(self.stream, commands)
     
     def join_server(self, username):
-        response = NapsterProtocol.send_command(self.socket, f"JOIN {username}")
-        if response == "CONFIRMJOIN":
+        # Uma varredura só: o resumo enviado no JOIN e o registro dos arquivos usam o mesmo poll
+        try:
+            changes = self.share_watcher.poll()
+        except Exception as e:
+            print(f"Erro ao escanear arquivos: {e}")
+            changes = None
+        manifest = self.share_manifest() if changes is not None else None
+        response = self.send_command(f"JOIN {username} {manifest}" if manifest else f"JOIN {username}")
+        if response and response.startswith("CONFIRMJOIN"):
             self.username = username
             print(f"Usuário {username} registrado com sucesso!")
-            self.auto_share_files()
+            if response == "CONFIRMJOIN SYNCED":
+                # O servidor restaurou nossos arquivos e o resumo confere: nada a reenviar
+                self.files_registered = True
+                print("Arquivos já registrados no servidor")
+                # O resumo já inclui as mudanças deste poll
+                changes = ([], [])
+            self.auto_share_files(changes)
             return True
+        elif response and response.startswith("BUSY"):
+            print(f"Servidor ocupado ({response[5:]}); tente novamente mais tarde")
+            return False
         else:
             print(f"Erro ao registrar: {response}")
             return False
     
-    def create_file(self, filename, size):
-        response = NapsterProtocol.send_command(self.socket, f"CREATEFILE {filename} {size}")
+    def share_manifest(self):
+        # Mesmo critério do servidor: com nomes repetidos em subpastas, vale o último enviado
+        shared = {file_info['name']: (file_info['size'], file_info['hash'])
+                  for file_info in self.share_watcher.files.values()}
+        if not shared:
+            return None
+        return manifest_hash((name, size, content_hash) for name, (size, content_hash) in shared.items())
+    
+    def create_file(self, filename, size, content_hash=None):
+        command = f"CREATEFILE {filename} {size}"
+        if content_hash:
+            command += f" {content_hash}"
+        response = self.send_command(command)
         if response and response.startswith("CONFIRMCREATEFILE"):
             return True
         return False
     
+    def create_files(self, files):
+        manifest = '\n'.join(f"{file_info['name']} {file_info['size']} {file_info['hash']}" for file_info in files)
+        response = self.send_command(f"CREATEFILE_BULK {len(files)}\n{manifest}")
+        if response and response.startswith("CONFIRMCREATEFILE_BULK"):
+            return int(response.split()[1])
+        return 0
+    
     def delete_file(self, filename):
-        response = NapsterProtocol.send_command(self.socket, f"DELETEFILE {filename}")
+        response = self.send_command(f"DELETEFILE {filename}")
         if response and response.startswith("CONFIRMDELETEFILE"):
             print(f"Arquivo {filename} removido do servidor")
             return True
         return False
     
-    def auto_share_files(self):
-        files = self.file_manager.scan_files()
+    def auto_share_files(self, changes=None):
+        # changes: resultado de um poll recém-feito, para não varrer a pasta de novo
+        if changes is None:
+            try:
+                changes = self.share_watcher.poll()
+            except Exception as e:
+                print(f"Erro ao escanear arquivos: {e}")
+                return
+        changed, removed = changes
+        
+        if self.files_registered:
+            if changed or removed:
+                self.sync_share_changes(changed, removed)
+            else:
+                print("Nenhuma alteração na pasta /public")
+            return
+        
+        files = list(self.share_watcher.files.values())
         if files:
-            success_count = 0
-            for file_info in files:
-                if self.create_file(file_info['name'], file_info['size']):
-                    success_count += 1
+            success_count = self.create_files(files)
+            self.files_registered = success_count == len(files)
             print(f"Compartilhados {success_count}/{len(files)} arquivos da pasta /public")
         else:
+            self.files_registered = True
             print("Nenhum arquivo encontrado na pasta /public")
     
-    def search_files(self, query):
-        response = NapsterProtocol.send_command(self.socket, f"SEARCH {query}")
-        files = NapsterProtocol.parse_file_response(response)
+    def sync_share_changes(self, changed, removed):
+        if changed:
+            self.create_files(changed)
         
-        if files:
-            print(f"\n=== RESULTADOS PARA '{query}' ===")
-            for i, file_info in enumerate(files, 1):
-                print(f"{i}. {file_info['filename']}")
-                print(f"   IP: {file_info['ip_address']}")
-                print(f"   Tamanho: {file_info['size']} bytes")
-                print("-" * 40)
+        # Outro arquivo com o mesmo nome pode continuar compartilhado em outra subpasta
+        still_shared = {file_info['name'] for file_info in self.share_watcher.files.values()}
+        deleted = [file_info['name'] for file_info in removed if file_info['name'] not in still_shared]
+        if deleted:
+            self.send_commands([f"DELETEFILE {filename}" for filename in deleted])
+        
+        print(f"Pasta /public sincronizada: {len(changed)} novos/alterados, {len(deleted)} removidos")
+    
+    def start_share_watcher(self):
+        self.share_watcher.start(self.sync_share_changes)
+    
+    def search_files(self, query, page_size=50, sample_size=8):
+        # Com termos de busca, os resultados vêm ordenados por relevância e popularidade
+        ranked = any('=' not in part for part in query.split())
+        files = []
+        cursor = None
+        while True:
+            page, cursor = self._search_page(query, page_size, cursor, len(files), ranked, sample_size)
+            files.extend(page)
+            if not files:
+                print(f"Nenhum arquivo encontrado para '{query}'")
+                return
+        
+            prompt = "\nDeseja baixar algum arquivo? (digite o número, "
+            prompt += "'m' para mais resultados ou 'n' para não): " if cursor else "ou 'n' para não): "
+            choice = input(prompt).strip()
+            if choice.lower() == 'm' and cursor:
+                continue
+            break
             
-            choice = input("\nDeseja baixar algum arquivo? (digite o número ou 'n' para não): ").strip()
-            if choice.isdigit():
-                index = int(choice) - 1
-                if 0 <= index < len(files):
-                    file_to_download = files[index]
-                    self._handle_download_options(file_to_download)
-        else:
-            print(f"Nenhum arquivo encontrado para '{query}'")
+        if choice.isdigit():
+            index = int(choice) - 1
+            if 0 <= index < len(files):
+                file_to_download = files[index]
+                self._handle_download_options(file_to_download, file_to_download['peers'])
+    
+    def _search_page(self, query, limit, cursor, shown=0, ranked=False, group=None):
+        # O servidor envia os resultados em vários quadros terminados por "END [cursor]";
+        # cada quadro é exibido assim que chega
+        files = []
+        next_cursor = None
+        with self.command_lock:
+            try:
+                self.stream.send_message(NapsterProtocol.format_search_command(query, limit, cursor, ranked, group))
+                while True:
+                    frame = self.stream.read_message()
+                    if frame is None:
+                        print("Conexão encerrada durante a busca")
+                        break
+                    if frame.startswith("END"):
+                        next_cursor = NapsterProtocol.parse_search_end(frame)
+                        break
+                    if frame.startswith("ERROR"):
+                        print(f"Erro na busca: {frame}")
+                        break
+                    
+                    page = NapsterProtocol.parse_file_response(frame)
+                    if not shown and not files and page:
+                        print(f"\n=== RESULTADOS PARA '{query}' ===")
+                    for i, file_info in enumerate(page, shown + len(files) + 1):
+                        print(f"{i}. {file_info['filename']}")
+                        print(f"   IP: {file_info['ip_address']}")
+                        print(f"   Tamanho: {file_info['size']} bytes")
+                        if file_info['replicas'] > 1:
+                            print(f"   Réplicas: {file_info['replicas']} pares ({len(file_info['peers'])} sugeridos)")
+                        print("-" * 40)
+                    files.extend(page)
+            except Exception as e:
+                print(f"Erro na comunicação: {e}")
+        return files, next_cursor
     
-    def _handle_download_options(self, file_info):
+    def _handle_download_options(self, file_info, sources):
         print("\nOpções de download:")
         print("1. Arquivo completo")
         print("2. Download com offset")
+        print(f"3. Download paralelo ({len(set(sources))} fontes)")
         
         download_choice = input("Escolha uma opção: ").strip()
         
         if download_choice == "1":
-            self.download_file(file_info['ip_address'], file_info['filename'])
+            self.download_file(file_info['ip_address'], file_info['filename'], content_hash=file_info['hash'],
+                               size=file_info['size'])
         elif download_choice == "2":
             try:
                 offset_start = int(input("Digite o offset inicial: "))
@@ -124,55 +312,183 @@ class NapsterClient:
                     file_info['ip_address'], 
                     file_info['filename'],
                     offset_start,
-                    offset_end
+                    offset_end,
+                    content_hash=file_info['hash'],
+                    size=file_info['size']
                 )
             except ValueError:
                 print("Valores de offset inválidos")
+        elif download_choice == "3":
+            self.download_file_swarm(file_info['filename'], file_info['size'], sources, file_info['hash'])
     
-    def download_file(self, ip_address, filename, offset_start=0, offset_end=None):
+    def download_file(self, ip_address, filename, offset_start=0, offset_end=None, content_hash=None, max_attempts=3,
+                      size=None):
+        # Intervalos e arquivo completo vão para o mesmo arquivo final, pré-alocado no
+        # tamanho total e gravado nas posições de origem. O diário marca os intervalos já
+        # recebidos, então downloads de partes diferentes se completam sem arquivos
+        # temporários nem cópia para juntar as partes
+        ranged = offset_start > 0 or offset_end is not None
+        if ranged and size is None:
+            print("Download com offset exige o tamanho do arquivo")
+            return False
+        if size is not None and (offset_start >= size or (offset_end is not None and offset_end > size)):
+            print("Valores de offset fora do arquivo")
+            return False
+        verifier = self.fetch_verifier(ip_address, filename, content_hash) if content_hash else None
+        
+        try:
+            file_path, fd = self.file_manager.open_for_positional_write(filename)
+        except Exception as e:
+            print(f"Erro no download: {e}")
+            return False
+        
+        journal = DownloadJournal(file_path)
         try:
-            download_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            download_socket.connect((ip_address, self.file_port))
+            if size is not None:
+                if journal.size != size or journal.content_hash != content_hash:
+                    preallocate(fd, size)
+                    journal.start(size, content_hash)
+            elif journal.size is None or journal.content_hash != content_hash:
+                # Tamanho desconhecido: vem na resposta do primeiro GET
+                journal.start(None, content_hash)
+                self._fetch_range(ip_address, filename, 0, None, fd, journal, verifier)
             
-            FileTransferProtocol.send_get_command(download_socket, filename, offset_start, offset_end)
+            range_end = offset_end if offset_end is not None else journal.size
+            for attempt in range(max_attempts):
+                ranges = journal.missing(offset_start, range_end) if journal.size is not None else []
+                if not ranges:
+                    break
+                missing = journal.missing_bytes(offset_start, range_end)
+                if attempt or missing < range_end - offset_start:
+                    print(f"Retomando download de {filename}: faltam {missing} de {range_end - offset_start} bytes")
+                for start, end in ranges:
+                    if verifier:
+                        # Peças só são verificáveis inteiras: amplia o intervalo até as fronteiras
+                        start, end = verifier.align(start, end)
+                    if not self._fetch_range(ip_address, filename, start, end, fd, journal, verifier):
+                        break
+        except Exception as e:
+            print(f"Erro no download: {e}")
+        finally:
+            journal.save(fd)
+            os.close(fd)
+        
+        if journal.is_complete():
+            journal.finish()
+            print(f"Arquivo {filename} baixado com sucesso em {file_path}")
+            print(f"Bytes baixados: {journal.size} de {journal.size}")
+            return True
+        
+        if journal.size is None:
+            return False
+        range_end = offset_end if offset_end is not None else journal.size
+        missing = journal.missing_bytes(offset_start, range_end)
+        if ranged and not missing:
+            print(f"Bytes {offset_start}-{range_end} de {filename} baixados em {file_path}; "
+                  f"faltam {journal.missing_bytes()} de {journal.size} bytes do arquivo")
+            return True
+        print(f"Download de {filename} interrompido; faltam {missing} de {range_end - offset_start} bytes")
+        print("Repita o download para retomar de onde parou")
+        return False
+    
+    def _fetch_range(self, ip_address, filename, start, end, fd, journal, verifier=None):
+        connection = self.connection_pool.acquire(ip_address)
+        # Só volta ao pool uma conexão cuja resposta foi lida por inteiro: depois de um
+        # timeout, BUSY ou erro, a resposta atrasada seria lida pelo próximo GET
+        reusable = False
+        try:
+            download_stream = connection.stream
+            FileTransferProtocol.send_get_command(download_stream, filename, start, end, self.compression)
             
-            response = download_socket.recv(1024).decode('utf-8')
-            if response.startswith("OK"):
-                bytes_to_receive = int(response.split()[1])
-                
-                if offset_start > 0 or offset_end is not None:
-                    save_filename = f"{filename}.part_{offset_start}_{offset_end or 'end'}"
-                else:
-                    save_filename = filename
-                
-                with self.file_manager.write_file_incrementally(save_filename) as f:
-                    received = 0
-                    while received < bytes_to_receive:
-                        data = download_socket.recv(min(1024, bytes_to_receive - received))
-                        if not data:
-                            break
-                        f.write(data)
-                        received += len(data)
-                
-                print(f"Arquivo {filename} baixado com sucesso como {save_filename}")
-                print(f"Bytes baixados: {received} de {bytes_to_receive}")
-                return True
-            else:
+            response = FileTransferProtocol.receive_response(download_stream)
+            if response.startswith("BUSY"):
+                print(f"{ip_address} está ocupado ({response[5:]}); tente novamente mais tarde")
+                return False
+            size, codec = FileTransferProtocol.parse_get_response(response)
+            if size is None:
+                # "ERROR ..." não traz corpo: a conexão segue limpa
+                reusable = response.startswith("ERROR")
                 print(f"Erro ao baixar arquivo: {response}")
                 return False
-                
+            bytes_to_receive = size
+            if journal.size is None:
+                preallocate(fd, start + bytes_to_receive)
+                journal.start(start + bytes_to_receive, journal.content_hash)
+            
+            pieces = verifier.stream(start) if verifier else None
+            received = 0
+            # Um buffer pré-alocado por download: recv_into preenche e pwrite grava direto dele
+            buffer = memoryview(bytearray(self.receive_buffer_size))
+            for data in FileTransferProtocol.receive_chunks(download_stream, bytes_to_receive, buffer, codec):
+                count = len(data)
+                position = start + received
+                os.pwrite(fd, data, position)
+                if pieces is None:
+                    journal.add(position, position + count, fd)
+                else:
+                    for piece_start, piece_end, ok in pieces.update(data):
+                        if ok:
+                            journal.add(piece_start, piece_end, fd)
+                        else:
+                            print(f"Peça {piece_start}-{piece_end} de {filename} corrompida; será baixada novamente")
+                received += count
+            
+            reusable = received == bytes_to_receive
+            return reusable
+        finally:
+            self.connection_pool.release(connection, reusable=reusable)
+    
+    def fetch_verifier(self, ip_address, filename, content_hash):
+        try:
+            connection = self.connection_pool.acquire(ip_address)
+            try:
+                FileTransferProtocol.send_hashes_command(connection.stream, filename)
+                response = connection.stream.read_message()
+                self.connection_pool.release(connection, reusable=response is not None)
+            except Exception:
+                self.connection_pool.release(connection, reusable=False)
+                raise
+        except Exception as e:
+            print(f"Erro ao obter hashes de {ip_address}: {e}")
+            return None
+        
+        piece_size, size, advertised_hash, piece_hashes = FileTransferProtocol.parse_hashes_response(response)
+        if piece_size is None or advertised_hash != content_hash or root_hash(piece_hashes) != content_hash:
+            print(f"Hashes de {filename} em {ip_address} não conferem; download sem verificação")
+            return None
+        
+        return PieceVerifier(size, piece_hashes, piece_size)
+    
+    def download_file_swarm(self, filename, size, peers, content_hash=None):
+        try:
+            verifier = None
+            if content_hash:
+                for ip_address in dict.fromkeys(peers):
+                    verifier = self.fetch_verifier(ip_address, filename, content_hash)
+                    if verifier:
+                        break
+            
+            swarm = SwarmDownload(filename, size, peers, self.connection_pool, verifier=verifier,
+                                  compression=self.compression, content_hash=content_hash)
+            file_path, complete = swarm.run()
+            
+            for ip_address, received in swarm.bytes_by_peer.items():
+                print(f"   {ip_address}: {received} bytes")
+            if complete:
+                print(f"Arquivo {filename} baixado com sucesso em {file_path}")
+            else:
+                print(f"Download de {filename} incompleto: nenhuma fonte restante")
+            return complete
         except Exception as e:
             print(f"Erro no download: {e}")
             return False
-        finally:
-            download_socket.close()
     
     def start_file_server(self):
         try:
             self.file_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.file_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.file_server_socket.bind(('', self.file_port))
-            self.file_server_socket.listen(5)
+            self.file_server_socket.listen(self.file_backlog)
             
             print(f"Servidor de arquivos iniciado na porta {self.file_port}")
             
@@ -181,67 +497,147 @@ class NapsterClient:
                     client_socket, address = self.file_server_socket.accept()
                     if not self.running:
                         break
-                    print(f"Solicitação de arquivo de {address}")
-                    
-                    file_thread = threading.Thread(
-                        target=self.handle_file_request,
-                        args=(client_socket, address)
-                    )
-                    file_thread.start()
+                    logger.debug("Solicitação de arquivo de %s", address)
+                    self.metrics.increment('file_server.connections')
+                    self.file_pool.submit(client_socket, address)
                 except Exception as e:
                     if self.running:
-                        print(f"Erro no servidor de arquivos: {e}")
+                        logger.error("Erro no servidor de arquivos: %s", e)
                     break
                     
         except Exception as e:
             print(f"Erro ao iniciar servidor de arquivos: {e}")
+        finally:
+            self.file_pool.stop()
+    
+    def reject_file_request(self, client_socket, address, reason):
+        self.metrics.increment('file_server.rejected')
+        logger.warning("Solicitação de %s recusada: %s", address, reason)
+        client_socket.settimeout(1.0)
+        FileTransferProtocol.send_response(MessageStream(client_socket), f"BUSY {reason}")
     
     def handle_file_request(self, client_socket, address):
+        stream = MessageStream(client_socket)
+        client_socket.settimeout(self.file_idle_timeout)
+        set_socket_buffers(client_socket, send=self.socket_buffer_size)
+        # A resposta "OK" e os dados saem em escritas separadas; sem TCP_NODELAY, pedidos
+        # pequenos esperam o ACK atrasado de quem baixa (~40 ms) a cada GET
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        throttle = self.upload_limiter.throttle(address[0])
         try:
-            command = client_socket.recv(1024).decode('utf-8').strip()
+            # Conexão persistente: atende vários comandos até o par fechar ou ficar ocioso
+            idle_since = time.monotonic()
+            while self.running:
+                if not stream.buffer:
+                    if not wait_readable(client_socket, 1.0):
+                        # Ociosa, a conexão cede a thread do pool se houver outras na fila
+                        if self.file_pool.queued() or time.monotonic() - idle_since >= self.file_idle_timeout:
+                            break
+                        continue
+                command = stream.read_message(4096)
+                if command is None:
+                    break
+                self.process_file_command(stream, client_socket, address, command.strip(), throttle)
+                idle_since = time.monotonic()
             
-            if command.startswith("GET"):
-                filename, offset_start, offset_end = FileTransferProtocol.parse_get_command(command)
-                
-                if filename is None:
-                    FileTransferProtocol.send_response(client_socket, "ERROR Invalid command format")
-                    return
-                
-                if self.file_manager.file_exists(filename):
-                    file_size = self.file_manager.get_file_size(filename)
-                    
-                    if offset_start < 0 or offset_start >= file_size:
-                        FileTransferProtocol.send_response(client_socket, "ERROR Invalid offset start")
-                        return
-                    
-                    if offset_end is None:
-                        offset_end = file_size
-                    elif offset_end > file_size or offset_end <= offset_start:
-                        FileTransferProtocol.send_response(client_socket, "ERROR Invalid offset end")
-                        return
-                    
-                    bytes_to_send = offset_end - offset_start
-                    
-                    FileTransferProtocol.send_response(client_socket, f"OK {bytes_to_send}")
-                    
-                    data = self.file_manager.read_file_chunk(filename, offset_start, bytes_to_send)
-                    client_socket.send(data)
-                    
-                    print(f"Arquivo {filename} enviado para {address} (bytes {offset_start}-{offset_end})")
-                else:
-                    FileTransferProtocol.send_response(client_socket, "ERROR File not found")
-            else:
-                FileTransferProtocol.send_response(client_socket, "ERROR Unknown command")
-                
+        except socket.timeout:
+            pass
+        except ConnectionAbortedError as e:
+            # No meio dos dados não dá para responder ERROR; só fechar a conexão
+            self.metrics.increment('file_server.errors')
+            logger.warning("Envio para %s interrompido: %s", address, e)
         except Exception as e:
-            print(f"Erro ao enviar arquivo: {e}")
+            self.metrics.increment('file_server.errors')
+            logger.warning("Erro ao enviar arquivo para %s: %s", address, e)
             try:
-                FileTransferProtocol.send_response(client_socket, "ERROR Internal server error")
+                FileTransferProtocol.send_response(stream, "ERROR Internal server error")
             except:
                 pass
         finally:
             client_socket.close()
     
+    def process_file_command(self, stream, client_socket, address, command, throttle=None):
+        if command.startswith("HASHES"):
+            parts = command.split()
+            if len(parts) < 2 or not self.file_manager.file_exists(parts[1]):
+                FileTransferProtocol.send_response(stream, "ERROR File not found")
+                return
+            
+            piece_size, file_size, content_hash, piece_hashes = self.file_manager.get_hashes(parts[1])
+            FileTransferProtocol.send_response(
+                stream,
+                FileTransferProtocol.format_hashes_response(piece_size, file_size, content_hash, piece_hashes)
+            )
+            self.metrics.increment('file_server.hashes_served')
+        
+        elif command == "STATS":
+            FileTransferProtocol.send_response(stream, "STATS\n" + self.metrics.format())
+        
+        elif command.startswith("GET"):
+            filename, offset_start, offset_end, compression = FileTransferProtocol.parse_get_command(command)
+            
+            if filename is None:
+                FileTransferProtocol.send_response(stream, "ERROR Invalid command format")
+                return
+            
+            if self.file_manager.file_exists(filename):
+                file_size = self.file_manager.get_file_size(filename)
+                
+                if offset_start < 0 or offset_start >= file_size:
+                    FileTransferProtocol.send_response(stream, "ERROR Invalid offset start")
+                    return
+                
+                if offset_end is None:
+                    offset_end = file_size
+                elif offset_end > file_size or offset_end <= offset_start:
+                    FileTransferProtocol.send_response(stream, "ERROR Invalid offset end")
+                    return
+                
+                bytes_to_send = offset_end - offset_start
+                codec = self.choose_compression(filename, bytes_to_send, compression)
+                
+                FileTransferProtocol.send_response(stream, f"OK {bytes_to_send} {codec}" if codec else f"OK {bytes_to_send}")
+                
+                started = time.perf_counter()
+                self.metrics.increment('file_server.transfers_active')
+                try:
+                    if codec:
+                        compressor = COMPRESSION_CODECS[codec][0]()
+                        sent = self.file_manager.send_compressed_range(client_socket, filename, offset_start,
+                                                                       bytes_to_send, compressor, throttle=throttle)
+                        self.metrics.increment(f'file_server.compressed.{codec}')
+                        self.metrics.increment('file_server.bytes_sent_compressed', sent)
+                    else:
+                        sent = self.file_manager.send_file_range(client_socket, filename, offset_start,
+                                                                 bytes_to_send, throttle=throttle)
+                        if sent < bytes_to_send:
+                            # O arquivo encolheu desde o último scan: quem baixa ficaria esperando
+                            # os bytes que faltam, então a conexão é encerrada
+                            self.file_manager.forget(filename)
+                            raise ConnectionAbortedError(f"{filename} encolheu durante o envio "
+                                                         f"({sent} de {bytes_to_send} bytes)")
+                finally:
+                    self.metrics.increment('file_server.transfers_active', -1)
+                self.metrics.increment('file_server.files_served')
+                self.metrics.increment('file_server.bytes_served', bytes_to_send)
+                self.metrics.observe('file_server.latency.get', time.perf_counter() - started)
+                
+                logger.debug("Arquivo %s enviado para %s (bytes %d-%d)", filename, address, offset_start, offset_end)
+            else:
+                FileTransferProtocol.send_response(stream, "ERROR File not found")
+        else:
+            FileTransferProtocol.send_response(stream, "ERROR Unknown command")
+    
+    def choose_compression(self, filename, bytes_to_send, offered):
+        # Primeira compressão oferecida que conhecemos, exceto para intervalos pequenos e
+        # formatos já comprimidos (que seguem por sendfile)
+        if bytes_to_send < self.min_compress_size or not self.file_manager.is_compressible(filename):
+            return None
+        for name in offered:
+            if name in COMPRESSION_CODECS:
+                return name
+        return None
+    
     def get_user_info(self, ip_address):
         message = {
             "command": "GET_USER_INFO",
@@ -273,6 +669,8 @@ class NapsterClient:
         file_server_thread = threading.Thread(target=self.start_file_server)
         file_server_thread.daemon = True
         file_server_thread.start()
+        self.start_share_watcher()
+        self.start_heartbeat()
         
         while True:
             print("\n=== MENU ===")
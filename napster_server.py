@@ -1,20 +1,58 @@
+import bisect
+import itertools
+import logging
 import socket
 import threading
-from protocol import NapsterProtocol
+import time
+from protocol import NapsterProtocol, MessageStream, MAX_FRAME_SIZE
+from catalog import Catalog
+from search_index import SearchQuery
+from query_cache import QueryCache, TOO_LARGE
+from catalog_store import CatalogStore
+from hashing import manifest_hash
+from lease_table import LeaseTable
+from metrics import Metrics
+from worker_pool import WorkerPool
+
+logger = logging.getLogger('napster.server')
+
+COMMANDS = ('JOIN', 'CREATEFILE', 'CREATEFILE_BULK', 'DELETEFILE', 'SEARCH', 'LEAVE', 'HEARTBEAT',
+            'CACHESTATS', 'STATS')
 
 class NapsterServer:
-    def __init__(self, host='localhost', port=1234):
+    def __init__(self, host='localhost', port=1234, search_batch_size=256, data_folder=None,
+                 lease_ttl=90.0, sweep_interval=5.0, backlog=128, max_workers=512, max_queue=1024,
+                 max_per_ip=16, queue_timeout=10.0):
         self.host = host
         self.port = port
-        self.clients = {}  
-        self.all_files = {}  
+        self.backlog = backlog
+        self.search_batch_size = search_batch_size
+        self.catalog = Catalog()
+        self.query_cache = QueryCache()
+        # Sem pasta de dados o catálogo vive só em memória
+        self.store = CatalogStore(data_folder) if data_folder else None
+        self.restored_peers = set()
+        # Pares que somem sem FIN deixam de renovar o prazo e são removidos na varredura
+        self.leases = LeaseTable(lease_ttl)
+        self.sweep_interval = sweep_interval
+        # Cada sessão ocupa uma thread do pool; acima do limite a conexão espera na fila,
+        # e acima da fila (ou do limite por IP) recebe BUSY
+        self.pool = WorkerPool(self.handle_client, self.reject_client, max_workers, max_queue,
+                               max_per_ip, queue_timeout)
+        self.metrics = Metrics()
+        self.register_gauges()
         self.running = True
         
     def start(self):
+        self.open_store()
+        self.start_lease_sweeper()
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
-        server_socket.listen(5)
+        server_socket.listen(self.backlog)
+        self.metrics.gauge('pool.workers', lambda: self.pool.workers)
+        self.metrics.gauge('pool.busy', lambda: self.pool.busy)
+        self.metrics.gauge('pool.queued', self.pool.queued)
         
         print(f"Servidor iniciado em {self.host}:{self.port}")
         print("Aguardando conexões...")
@@ -22,69 +60,161 @@ class NapsterServer:
         try:
             while self.running:
                 client_socket, address = server_socket.accept()
-                print(f"Nova conexão de {address}")
-                
-                client_thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, address)
-                )
-                client_thread.start()
+                logger.debug("Nova conexão de %s", address)
+                self.pool.submit(client_socket, address)
         except KeyboardInterrupt:
             print("\nServidor sendo encerrado...")
         finally:
             self.running = False
+            self.pool.stop()
             server_socket.close()
+            self.close_store()
+    
+    def open_store(self):
+        if self.store is not None:
+            self.store.load(self.catalog)
+            self.restored_peers = {ip_address for ip_address, _ in self.catalog.export_peers()}
+            for ip_address in self.restored_peers:
+                self.leases.renew(ip_address)
+            self.store.start(self.catalog)
+    
+    def close_store(self):
+        if self.store is not None:
+            self.store.close(self.catalog)
+    
+    def start_lease_sweeper(self):
+        thread = threading.Thread(target=self.sweep_leases)
+        thread.daemon = True
+        thread.start()
+    
+    def sweep_leases(self):
+        while self.running:
+            time.sleep(self.sweep_interval)
+            try:
+                self.expire_peers()
+            except Exception as e:
+                logger.error("Erro ao expirar pares: %s", e)
+    
+    def expire_peers(self):
+        for ip_address in self.leases.expire():
+            sessions = self.catalog.sessions(ip_address)
+            logger.info("Par %s sem sinal de vida há %.0fs; removendo", ip_address, self.leases.ttl)
+            self.metrics.increment('peers.expired')
+            self.user_leave(ip_address)
+            for session in sessions:
+                self.close_session(session)
+    
+    def close_session(self, session):
+        # shutdown acorda a thread bloqueada em recv, que então encerra a conexão
+        try:
+            session.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def reject_client(self, client_socket, address, reason):
+        self.metrics.increment('connections.rejected')
+        logger.warning("Conexão de %s recusada: %s", address, reason)
+        client_socket.settimeout(1.0)
+        MessageStream(client_socket).send_message(f"BUSY {reason}")
     
     def handle_client(self, client_socket, address):
         ip_address = address[0]
+        # Respostas como SEARCH saem em vários quadros pequenos; sem TCP_NODELAY o
+        # algoritmo de Nagle segura o último até o ACK atrasado do cliente (~40 ms)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = MessageStream(client_socket)
+        self.metrics.increment('connections.active')
         try:
             while self.running:
-                data = client_socket.recv(1024).decode('utf-8').strip()
-                if not data:
+                data = stream.read_message(MAX_FRAME_SIZE)
+                if data is None:
                     break
                 
-                response = self.process_command(client_socket, ip_address, data)
-                if response:
-                    client_socket.send(response.encode('utf-8'))
+                started = time.perf_counter()
+                response = self.process_command(client_socket, ip_address, data.strip())
+                for frame in self.response_frames(response):
+                    stream.send_message(frame)
+                self.record_latency(data, started)
                     
         except Exception as e:
-            print(f"Erro ao lidar com cliente {address}: {e}")
+            self.metrics.increment('errors.connection')
+            logger.warning("Erro ao lidar com cliente %s: %s", address, e)
         finally:
-            self.user_leave(ip_address)
+            self.metrics.increment('connections.active', -1)
+            # No encerramento o par continua no catálogo e entra no snapshot
+            if self.running:
+                self.user_leave(ip_address)
             client_socket.close()
-            print(f"Cliente {address} desconectado")
+            logger.debug("Cliente %s desconectado", address)
+    
+    def register_gauges(self):
+        self.metrics.gauge('catalog.peers', lambda: self.catalog.counts()[0])
+        self.metrics.gauge('catalog.files', lambda: self.catalog.counts()[1])
+        self.metrics.gauge('leases.tracked', lambda: len(self.leases.deadlines))
+        self.metrics.gauge('threads', threading.active_count)
+
+        for name in self.query_cache.stats():
+            self.metrics.gauge(f"cache.{name}", lambda name=name: self.query_cache.stats()[name])
+    
+    def command_name(self, command):
+        cmd = command.split(None, 1)[0] if command.strip() else ''
+        return cmd.lower() if cmd in COMMANDS else 'unknown'
+    
+    def record_latency(self, command, started):
+        # Inclui o envio de todos os quadros da resposta (SEARCH é transmitido aos poucos)
+        self.metrics.observe(f"latency.{self.command_name(command)}", time.perf_counter() - started)
     
     def process_command(self, client_socket, ip_address, command):
-        parts = command.split()
+        head, _, body = command.partition('\n')
+        parts = head.split()
         if not parts:
             return "ERROR Invalid command"
         
         cmd = parts[0]
+        self.leases.renew(ip_address)
+        self.metrics.increment(f"commands.{self.command_name(cmd)}")
         
         if cmd == 'JOIN':
             return self.handle_join(client_socket, ip_address, parts)
         elif cmd == 'CREATEFILE':
             return self.handle_create_file(ip_address, parts)
+        elif cmd == 'CREATEFILE_BULK':
+            return self.handle_create_file_bulk(ip_address, parts, body)
         elif cmd == 'DELETEFILE':
             return self.handle_delete_file(ip_address, parts)
         elif cmd == 'SEARCH':
             return self.handle_search(parts)
         elif cmd == 'LEAVE':
             return self.handle_leave(ip_address)
+        elif cmd == 'HEARTBEAT':
+            return self.handle_heartbeat(ip_address)
+        elif cmd == 'CACHESTATS':
+            return self.handle_cache_stats()
+        elif cmd == 'STATS':
+            return self.handle_stats()
         else:
             return "ERROR Unknown command"
     
+    def response_frames(self, response):
+        # Comandos como SEARCH devolvem um gerador de quadros enviados à medida que são produzidos
+        return [response] if isinstance(response, str) else response
+    
     def handle_join(self, client_socket, ip_address, parts):
         if len(parts) < 2:
             return "ERROR Username required"
         
         username = parts[1]
-        self.clients[client_socket] = {'ip_address': ip_address, 'username': username}
-        
-        if ip_address not in self.all_files:
-            self.all_files[ip_address] = []
+        # Após reiniciar, o catálogo restaurado já tem os arquivos do par; se o resumo
+        # enviado no JOIN bate, ele não precisa reenviar nada
+        manifest = parts[2] if len(parts) >= 3 else None
+        synced = manifest is not None and manifest == self.peer_manifest(ip_address)
+        if ip_address in self.restored_peers:
+            self.restored_peers.discard(ip_address)
+            if not synced:
+                self.user_leave(ip_address)
+        self.catalog.add_client(client_socket, ip_address, username)
         
-        return "CONFIRMJOIN"
+        return "CONFIRMJOIN SYNCED" if synced else "CONFIRMJOIN"
     
     def handle_create_file(self, ip_address, parts):
         if len(parts) < 3:
@@ -92,18 +222,42 @@ class NapsterServer:
         
         filename = parts[1]
         size = int(parts[2])
+        content_hash = parts[3] if len(parts) >= 4 else None
         
-        if ip_address not in self.all_files:
-            self.all_files[ip_address] = []
+        self.catalog.add_file(ip_address, filename, size, content_hash)
+        self.query_cache.invalidate([filename])
+        if self.store is not None:
+            self.store.record_add(ip_address, [(filename, size, content_hash)])
         
-        self.all_files[ip_address] = [f for f in self.all_files[ip_address] if f['filename'] != filename]
+        return f"CONFIRMCREATEFILE {filename}"
+    
+    def handle_create_file_bulk(self, ip_address, parts, body):
+        if len(parts) < 2:
+            return "ERROR Invalid CREATEFILE_BULK format"
         
-        self.all_files[ip_address].append({
-            'filename': filename,
-            'size': size
-        })
+        try:
+            count = int(parts[1])
+            entries = []
+            for line in body.split('\n'):
+                fields = line.split()
+                if len(fields) == 2:
+                    entries.append((fields[0], int(fields[1]), None))
+                elif len(fields) == 3:
+                    entries.append((fields[0], int(fields[1]), fields[2]))
+                elif fields:
+                    raise ValueError(line)
+        except ValueError:
+            return "ERROR Invalid CREATEFILE_BULK format"
         
-        return f"CONFIRMCREATEFILE {filename}"
+        if len(entries) != count:
+            return "ERROR Invalid CREATEFILE_BULK count"
+        
+        self.catalog.add_files(ip_address, entries)
+        self.query_cache.invalidate([filename for filename, _, _ in entries])
+        if self.store is not None:
+            self.store.record_add(ip_address, entries)
+        
+        return f"CONFIRMCREATEFILE_BULK {count}"
     
     def handle_delete_file(self, ip_address, parts):
         if len(parts) < 2:
@@ -111,36 +265,126 @@ class NapsterServer:
         
         filename = parts[1]
         
-        if ip_address in self.all_files:
-            self.all_files[ip_address] = [f for f in self.all_files[ip_address] if f['filename'] != filename]
+        if self.catalog.remove_file(ip_address, filename):
+            self.query_cache.invalidate([filename])
+            if self.store is not None:
+                self.store.record_remove(ip_address, filename)
         
         return f"CONFIRMDELETEFILE {filename}"
     
     def handle_search(self, parts):
-        pattern = parts[1].lower() if len(parts) > 1 else ""
-        results = []
+        # Varredura preguiçosa: não devolve pares cujo prazo venceu desde a última passada
+        self.expire_peers()
+        try:
+            terms, options, limit, cursor = NapsterProtocol.parse_search_command(parts)
+        except ValueError:
+            return "ERROR Invalid SEARCH options"
+        
+        query = SearchQuery(terms, **options)
+        if query.group:
+            format_row = lambda *row: self.format_group(*row, sample_size=query.group)
+        else:
+            format_row = self.format_file
+        
+        cacheable = self.query_cache.cacheable(query)
+        rows = self.query_cache.get(query) if cacheable else None
+        if rows is not None and rows is not TOO_LARGE:
+            start = bisect.bisect_right(rows, cursor, key=lambda result: result[0]) if cursor else 0
+            return self.stream_search(itertools.islice(rows, start, None), limit, format_row)
+        if rows is None and cursor is None and cacheable:
+            return self.stream_and_cache(query, limit, format_row)
+        return self.stream_search(self.search_results(query, limit, cursor), limit, format_row)
+    
+    def search_results(self, query, limit=None, cursor=None):
+        if query.group:
+            if query.ranked:
+                return self.catalog.ranked_group_rows(query, limit, cursor)
+            return self.catalog.group_rows(query, cursor)
         
-        for ip_address in self.all_files.keys():
-            for file in self.all_files[ip_address]:
-                if pattern in file['filename'].lower():
-                    results.append(f"FILE {file['filename']} {ip_address} {file['size']}")
+        if query.ranked:
+            return self.catalog.ranked_search(query, limit, cursor)
+        return self.catalog.iter_search(query, cursor)
+    
+    def stream_and_cache(self, query, limit, format_row):
+        # Preenche o cache com as linhas à medida que são enviadas, sem atrasar o primeiro
+        # quadro; o restante da lista (até max_rows) é lido depois que a página saiu. Na
+        # busca ordenada todas as linhas já são calculadas para a primeira página, então
+        # a mesma lista serve à resposta e ao cache
+        generations = self.query_cache.snapshot(query)
+        max_rows = self.query_cache.max_rows
+        results = iter(self.search_results(query))
+        rows = []
+        
+        def recorded():
+            for row in results:
+                if len(rows) <= max_rows:
+                    rows.append(row)
+                yield row
         
-        return '\n'.join(results) if results else ""
+        yield from self.stream_search(recorded(), limit, format_row)
+        rows.extend(itertools.islice(results, max(0, max_rows + 1 - len(rows))))
+        self.query_cache.put(query, generations, TOO_LARGE if len(rows) > max_rows else rows)
+    
+    def stream_search(self, results, limit, format_row):
+        batch = []
+        count = 0
+        last_order = None
+        for order, row in results:
+            if limit is not None and count == limit:
+                if batch:
+                    yield '\n'.join(batch)
+                yield "END " + ':'.join(str(field) for field in last_order)
+                return
+            
+            batch.append(format_row(*row))
+            count += 1
+            last_order = order
+            if len(batch) >= self.search_batch_size:
+                yield '\n'.join(batch)
+                batch = []
+        
+        if batch:
+            yield '\n'.join(batch)
+        yield "END"
+    
+    def format_file(self, filename, ip_address, size, content_hash):
+        if content_hash:
+            return f"FILE {filename} {ip_address} {size} {content_hash}"
+        return f"FILE {filename} {ip_address} {size}"
+    
+    def format_group(self, filename, size, content_hash, replicas, holders, sample_size=8):
+        peers = self.catalog.sample_peers(holders, sample_size)
+        return f"GROUP {filename} {size} {content_hash or '-'} {replicas} {','.join(peers)}"
+    
+    def handle_heartbeat(self, ip_address):
+        if not self.catalog.sessions(ip_address):
+            return "ERROR Not joined"
+        return "CONFIRMHEARTBEAT"
     
     def handle_leave(self, ip_address):
         self.user_leave(ip_address)
         return "CONFIRMLEAVE"
     
+    def peer_manifest(self, ip_address):
+        peer_files = self.catalog.peer_files(ip_address)
+        if not peer_files:
+            return None
+        return manifest_hash((filename, file_info['size'], file_info['hash'])
+                             for filename, file_info in peer_files.items())
+    
+    def handle_stats(self):
+        return "STATS\n" + self.metrics.format()
+    
+    def handle_cache_stats(self):
+        stats = self.query_cache.stats()
+        return "CACHESTATS " + ' '.join(f"{name}={value}" for name, value in stats.items())
+    
     def user_leave(self, ip_address):
-        if ip_address in self.all_files:
-            del self.all_files[ip_address]
-            print(f"Arquivos do IP {ip_address} removidos da memória")
-        
-        client_to_remove = None
-        for client_socket, client_info in self.clients.items():
-            if client_info['ip_address'] == ip_address:
-                client_to_remove = client_socket
-                break
-        
-        if client_to_remove and client_to_remove in self.clients:
-            del self.clients[client_to_remove]
+        self.leases.remove(ip_address)
+        removed = self.catalog.remove_peer(ip_address)
+        if removed is not None:
+            self.query_cache.invalidate(removed)
+            if self.store is not None:
+                self.store.record_leave(ip_address)
+            logger.debug("Arquivos do IP %s removidos da memória", ip_address)
+        
\ No newline at end of file
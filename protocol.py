@@ -1,16 +1,222 @@
+import lzma
+import select
 import socket
+import zlib
+
+# Cada mensagem de controle é enquadrada como "<tamanho>\n<payload>", de modo que
+# respostas de qualquer tamanho e comandos enviados em sequência (pipeline)
+# chegam íntegros independentemente de como o TCP fragmenta ou agrupa os bytes.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+MAX_HEADER_SIZE = 32
+
+# Transferências de arquivos leem para um buffer pré-alocado com recv_into, e os sockets
+# de dados pedem buffers de kernel maiores que o padrão
+RECV_BUFFER_SIZE = 256 * 1024
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Compressões aceitas no GET: nome -> (fábrica do compressor, fábrica do descompressor).
+# Níveis baixos: o objetivo é encurtar transferências em redes lentas, não o menor arquivo
+COMPRESSION_CODECS = {
+    'zlib': (lambda: zlib.compressobj(1), zlib.decompressobj),
+    'lzma': (lambda: lzma.LZMACompressor(preset=0), lzma.LZMADecompressor),
+}
+
+def set_socket_buffers(sock, receive=None, send=None):
+    # O kernel pode ajustar o valor (o Linux dobra e limita por net.core.[rw]mem_max).
+    # Buffer de recepção fixado antes do connect também define a escala da janela TCP
+    try:
+        if receive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive)
+        if send:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send)
+    except OSError:
+        pass
+
+def wait_readable(sock, timeout):
+    # select() não aceita descritores acima de FD_SETSIZE (1024), comuns em pares com
+    # muitas conexões; poll() não tem esse limite e fica como caminho padrão
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+def wait_writable(sock, timeout):
+    # Mesmo que wait_readable, para escrita; timeout None espera indefinidamente
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+    _, writable, _ = select.select([], [sock], [], timeout)
+    return bool(writable)
+
+def encode_frame(message):
+    payload = message.encode('utf-8') if isinstance(message, str) else message
+    return f"{len(payload)}\n".encode('ascii') + payload
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text):
+    # Aceita bytes ou sufixos K/M/G (ex.: 512K, 10M)
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+def parse_frame_header(line, max_size=MAX_FRAME_SIZE):
+    size = int(line.strip())
+    if size < 0 or (max_size is not None and size > max_size):
+        raise ValueError(f"Tamanho de mensagem inválido: {size}")
+    return size
+
+class MessageStream:
+
+    def __init__(self, sock, buffer_size=65536):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def _fill(self):
+        chunk = self.sock.recv(self.buffer_size)
+        if not chunk:
+            return False
+        self.buffer += chunk
+        return True
+
+    def read_line(self, max_size=MAX_HEADER_SIZE):
+        while True:
+            index = self.buffer.find(b'\n')
+            if index >= 0:
+                line = bytes(self.buffer[:index])
+                del self.buffer[:index + 1]
+                return line
+            if len(self.buffer) > max_size:
+                raise ValueError("Linha excede o tamanho máximo")
+            if not self._fill():
+                return None
+
+    def read_exact(self, size):
+        while len(self.buffer) < size:
+            if not self._fill():
+                break
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def recv(self, max_size):
+        if self.buffer:
+            data = bytes(self.buffer[:max_size])
+            del self.buffer[:max_size]
+            return data
+        return self.sock.recv(max_size)
+
+    def recv_into(self, view):
+        # Entrega primeiro o que sobrou no buffer de quadros; depois lê direto do socket
+        if self.buffer:
+            count = min(len(view), len(self.buffer))
+            view[:count] = self.buffer[:count]
+            del self.buffer[:count]
+            return count
+        return self.sock.recv_into(view)
+
+    def read_message(self, max_size=None):
+        header = self.read_line()
+        if header is None:
+            return None
+        size = parse_frame_header(header, max_size)
+        payload = self.read_exact(size)
+        if len(payload) < size:
+            return None
+        return payload.decode('utf-8')
+
+    def send_message(self, message):
+        self.sock.sendall(encode_frame(message))
+
+    def send_messages(self, messages):
+        self.sock.sendall(b''.join(encode_frame(message) for message in messages))
 
 class NapsterProtocol:
     
     @staticmethod
-    def send_command(sock, command):
+    def send_command(stream, command):
         try:
-            sock.send(f"{command}\n".encode('utf-8'))
-            response = sock.recv(4096).decode('utf-8').strip()
-            return response
+            stream.send_message(command)
+            response = stream.read_message()
+            return response.strip() if response is not None else None
         except Exception as e:
             print(f"Erro na comunicação: {e}")
             return None
+
+    @staticmethod
+    def send_commands(stream, commands, window=256):
+        # Envia em janelas para que nenhum dos lados bloqueie com os buffers cheios
+        responses = []
+        try:
+            for i in range(0, len(commands), window):
+                batch = commands[i:i + window]
+                stream.send_messages(batch)
+                for _ in batch:
+                    response = stream.read_message()
+                    responses.append(response.strip() if response is not None else None)
+            return responses
+        except Exception as e:
+            print(f"Erro na comunicação: {e}")
+            return responses + [None] * (len(commands) - len(responses))
+    
+    @staticmethod
+    def format_search_command(query, limit=None, cursor=None, ranked=False, group=None):
+        command = f"SEARCH {query}".rstrip()
+        if ranked:
+            command += " sort=rank"
+        if group:
+            command += f" group={group}"
+        if limit is not None:
+            command += f" limit={limit}"
+        if cursor:
+            command += f" cursor={cursor}"
+        return command
+    
+    @staticmethod
+    def parse_search_command(parts):
+        # SEARCH [termos...] [ext=mp3,txt] [min=1M] [max=10M] [sort=rank] [group=K] [limit=N] [cursor=...]
+        terms, limit, cursor = [], None, None
+        options = {'extensions': [], 'min_size': None, 'max_size': None, 'ranked': False, 'group': None}
+        for part in parts[1:]:
+            key, _, value = part.partition('=')
+            if key == "limit":
+                limit = int(value)
+            elif key == "cursor":
+                cursor = tuple(int(field) for field in value.split(':'))
+            elif key == "ext":
+                options['extensions'].extend(value.split(','))
+            elif key == "min":
+                options['min_size'] = parse_size(value)
+            elif key == "max":
+                options['max_size'] = parse_size(value)
+            elif key == "sort":
+                if value not in ("rank", "order"):
+                    raise ValueError(f"Ordenação desconhecida: {value}")
+                options['ranked'] = value == "rank"
+            elif key == "group":
+                options['group'] = int(value)
+                if options['group'] <= 0:
+                    raise ValueError("group deve ser positivo")
+            else:
+                terms.append(part)
+        if limit is not None and limit <= 0:
+            raise ValueError("limit deve ser positivo")
+        # Cursor: (par, entrada) ou (grupo) na ordem de chegada, precedido de
+        # (-qualidade, -réplicas) quando ordenado por relevância
+        cursor_fields = (1 if options['group'] else 2) + (2 if options['ranked'] else 0)
+        if cursor is not None and len(cursor) != cursor_fields:
+            raise ValueError("Cursor inválido")
+        return terms, options, limit, cursor
+    
+    @staticmethod
+    def parse_search_end(frame):
+        # Último quadro de um SEARCH: "END" ou "END <cursor>" quando há mais páginas
+        parts = frame.split()
+        return parts[1] if len(parts) > 1 else None
     
     @staticmethod
     def parse_file_response(response):
@@ -29,43 +235,154 @@ class NapsterProtocol:
                     files.append({
                         'filename': filename,
                         'ip_address': ip_address,
-                        'size': int(size)
+                        'size': int(size),
+                        'hash': parts[4] if len(parts) >= 5 else None,
+                        'replicas': 1,
+                        'peers': [ip_address]
+                    })
+            elif line.startswith("GROUP"):
+                # GROUP <arquivo> <tamanho> <hash ou -> <réplicas> <ip,ip,...>
+                parts = line.split()
+                if len(parts) >= 6:
+                    peers = parts[5].split(',')
+                    files.append({
+                        'filename': parts[1],
+                        'ip_address': peers[0],
+                        'size': int(parts[2]),
+                        'hash': parts[3] if parts[3] != '-' else None,
+                        'replicas': int(parts[4]),
+                        'peers': peers
                     })
         return files
 
 class FileTransferProtocol:
     
     @staticmethod
-    def send_get_command(sock, filename, offset_start=0, offset_end=None):
+    def send_get_command(stream, filename, offset_start=0, offset_end=None, compression=()):
         if offset_end is not None:
             command = f"GET {filename} {offset_start} {offset_end}"
         else:
             command = f"GET {filename} {offset_start}"
+        if compression:
+            # Compressões aceitas, em ordem de preferência; o par escolhe uma ou nenhuma
+            command += f" compress={','.join(compression)}"
         
-        sock.send(command.encode('utf-8'))
+        stream.send_message(command)
     
     @staticmethod
     def parse_get_command(command):
         parts = command.split()
         if len(parts) < 3:
-            return None, None, None
+            return None, None, None, []
         
         filename = parts[1]
         offset_start = int(parts[2])
-        offset_end = int(parts[3]) if len(parts) >= 4 else None
+        offset_end = None
+        compression = []
+        for part in parts[3:]:
+            if part.startswith("compress="):
+                compression = [name for name in part[len("compress="):].split(',') if name]
+            else:
+                offset_end = int(part)
         
-        return filename, offset_start, offset_end
+        return filename, offset_start, offset_end, compression
     
     @staticmethod
-    def send_response(sock, message):
-        sock.send(message.encode('utf-8'))
+    def parse_get_response(response):
+        # "OK <bytes>" para dados crus ou "OK <bytes> <compressão>" para quadros comprimidos
+        parts = response.split()
+        if len(parts) < 2 or parts[0] != "OK":
+            return None, None
+        codec = parts[2] if len(parts) >= 3 else None
+        if codec is not None and codec not in COMPRESSION_CODECS:
+            raise ValueError(f"Compressão desconhecida: {codec}")
+        return int(parts[1]), codec
     
     @staticmethod
-    def receive_data(sock, size):
-        data = b''
-        while len(data) < size:
-            chunk = sock.recv(min(size - len(data), 1024))
-            if not chunk:
-                break
-            data += chunk
+    def receive_chunks(stream, size, buffer, codec=None):
+        # Gera os `size` bytes de uma resposta de GET em pedaços. Sem compressão, cada
+        # pedaço é uma fatia de `buffer` preenchida com recv_into (válida só até o
+        # próximo); com compressão, lê os quadros "<tamanho>\n<dados>" até o quadro vazio
+        # final e gera a saída do descompressor
+        if codec is None:
+            received = 0
+            while received < size:
+                count = stream.recv_into(buffer[:min(len(buffer), size - received)])
+                if not count:
+                    return
+                received += count
+                yield buffer[:count]
+            return
+        
+        decompressor = COMPRESSION_CODECS[codec][1]()
+        produced = 0
+        while True:
+            header = stream.read_line()
+            if header is None:
+                return
+            remaining = parse_frame_header(header, None)
+            if remaining == 0:
+                return
+            while remaining:
+                count = stream.recv_into(buffer[:min(len(buffer), remaining)])
+                if not count:
+                    return
+                remaining -= count
+                data = buffer[:count]
+                while data is not None:
+                    # Saída limitada a um buffer por vez e ao que ainda cabe no tamanho
+                    # anunciado (+1 para notar o excesso): um quadro pequeno que expande
+                    # para gigabytes não chega inteiro à memória
+                    output = decompressor.decompress(data, min(len(buffer), size - produced + 1))
+                    produced += len(output)
+                    if produced > size:
+                        raise ValueError("Dados descomprimidos excedem o tamanho anunciado")
+                    if output:
+                        yield output
+                    # A entrada que sobrou fica em unconsumed_tail (zlib) ou dentro do
+                    # descompressor, que avisa com needs_input (LZMA)
+                    if decompressor.eof:
+                        data = None
+                    elif hasattr(decompressor, 'unconsumed_tail'):
+                        data = decompressor.unconsumed_tail or None
+                    else:
+                        data = None if decompressor.needs_input else b''
+    
+    @staticmethod
+    def send_hashes_command(stream, filename):
+        stream.send_message(f"HASHES {filename}")
+    
+    @staticmethod
+    def format_hashes_response(piece_size, size, content_hash, piece_hashes):
+        return '\n'.join([f"OK {piece_size} {size} {content_hash}"] + piece_hashes)
+    
+    @staticmethod
+    def parse_hashes_response(response):
+        lines = response.split('\n') if response else []
+        header = lines[0].split() if lines else []
+        if len(header) < 4 or header[0] != "OK":
+            return None, None, None, None
+        return int(header[1]), int(header[2]), header[3], [line for line in lines[1:] if line]
+    
+    @staticmethod
+    def send_response(stream, message):
+        stream.send_message(message)
+    
+    @staticmethod
+    def receive_response(stream):
+        response = stream.read_message(4096)
+        return response.strip() if response is not None else ""
+
+    @staticmethod
+    def receive_data(stream, size, buffer_size=RECV_BUFFER_SIZE):
+        # Um único bytearray do tamanho final, preenchido no lugar com recv_into
+        data = bytearray(size)
+        with memoryview(data) as view:
+            received = 0
+            while received < size:
+                count = stream.recv_into(view[received:received + buffer_size])
+                if not count:
+                    break
+                received += count
+        del data[received:]
         return data
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from search_index import trigrams, extension_of
+
+TOO_LARGE = object()
+
+class QueryCache:
+    # Guarda a lista completa e ordenada de resultados de cada consulta. Cada entrada
+    # lembra as gerações das chaves de que depende (trigramas do termo mais longo,
+    # extensões ou "todos"); mudar um arquivo incrementa as gerações das chaves do seu
+    # nome, invalidando só as consultas que poderiam enxergá-lo
+    def __init__(self, max_entries=1024, ttl=30.0, max_rows=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.entries = OrderedDict()  # chave da consulta -> (expira em, gerações, linhas)
+        self.generations = {}         # dependência -> geração
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.too_large = 0  # consultas já conhecidas por não caber, transmitidas do catálogo
+        self.invalidations = 0
+        self.evictions = 0
+
+    def key(self, query):
+        return (tuple(sorted(query.terms)), frozenset(query.extensions), query.min_size,
+                query.max_size, query.ranked, bool(query.group))
+
+    def dependencies(self, query):
+        indexed = [term for term in query.terms if len(term) >= 3]
+        if indexed:
+            # Todo nome que casa contém o termo inteiro e, portanto, todos os seus trigramas
+            return [('gram', gram) for gram in sorted(trigrams(max(indexed, key=len)))]
+        if query.extensions:
+            return [('ext', extension) for extension in sorted(query.extensions)]
+        return [('all',)]
+
+    def cacheable(self, query):
+        # Sem termos nem extensões a consulta depende de qualquer mudança no catálogo e
+        # quase nunca seria reaproveitada sob escrita constante
+        return self.dependencies(query) != [('all',)]
+
+    def snapshot(self, query):
+        with self.lock:
+            return tuple(self.generations.get(dependency, 0) for dependency in self.dependencies(query))
+
+    def get(self, query):
+        key = self.key(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, generations, rows = entry
+                current = tuple(self.generations.get(dependency, 0) for dependency in self.dependencies(query))
+                if expires > time.monotonic() and generations == current:
+                    self.entries.move_to_end(key)
+                    if rows is TOO_LARGE:
+                        self.too_large += 1
+                    else:
+                        self.hits += 1
+                    return rows
+                del self.entries[key]
+                if generations != current:
+                    self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, query, generations, rows):
+        # rows pode ser TOO_LARGE: lembra que a consulta não cabe e deve ser transmitida
+        with self.lock:
+            self.entries[self.key(query)] = (time.monotonic() + self.ttl, generations, rows)
+            self.entries.move_to_end(self.key(query))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, filenames):
+        with self.lock:
+            dependencies = {('all',)}
+            for filename in filenames:
+                lower_name = filename.lower()
+                dependencies.update(('gram', gram) for gram in trigrams(lower_name))
+                dependencies.add(('ext', extension_of(lower_name)))
+            for dependency in dependencies:
+                self.generations[dependency] = self.generations.get(dependency, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'too_large': self.too_large,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
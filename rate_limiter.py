@@ -0,0 +1,103 @@
+import collections
+import threading
+import time
+
+class TokenBucket:
+    # Enche `rate` bytes por segundo até `burst`. Um pedido maior que o saldo espera só
+    # até o saldo cobrir min(pedido, burst); o excedente vira dívida paga pelos próximos
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, size):
+        # Segundos até o pedido poder sair (0 se já pode)
+        self.refill(time.monotonic())
+        needed = min(size, self.burst)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, size):
+        self.tokens -= size
+
+    def wait(self, size):
+        # Versão bloqueante para um único usuário do balde
+        waited = 0.0
+        with self.lock:
+            while True:
+                delay = self.delay(size)
+                if delay <= 0:
+                    self.take(size)
+                    return waited
+                time.sleep(delay)
+                waited += delay
+
+class UploadLimiter:
+    # Limite global de envio compartilhado por todas as transferências do servidor de
+    # arquivos, com vez alternada entre quem baixa: cada IP tem sua fila de pedidos, e
+    # os IPs com pedidos pendentes são atendidos em rodízio, um bloco por vez. Assim um
+    # par com várias conexões não tira banda dos outros. Opcionalmente, cada conexão
+    # também tem seu próprio teto
+    def __init__(self, rate=None, per_connection_rate=None, chunk_size=64 * 1024):
+        self.chunk_size = chunk_size
+        self.per_connection_rate = per_connection_rate
+        # O balde comporta ao menos um bloco, senão nenhum pedido cheio passaria
+        self.bucket = TokenBucket(rate, max(rate // 4, chunk_size)) if rate else None
+        self.condition = threading.Condition()
+        self.waiting = collections.OrderedDict()  # ip -> deque de pedidos; a ordem é o rodízio
+        self.waited = 0.0
+
+    def enabled(self):
+        return self.bucket is not None or bool(self.per_connection_rate)
+
+    def acquire(self, key, size):
+        if self.bucket is None:
+            return
+        started = time.monotonic()
+        ticket = object()
+        with self.condition:
+            queue = self.waiting.get(key)
+            if queue is None:
+                queue = self.waiting[key] = collections.deque()
+            queue.append(ticket)
+            while True:
+                if next(iter(self.waiting)) == key and queue[0] is ticket:
+                    delay = self.bucket.delay(size)
+                    if delay <= 0:
+                        self.bucket.take(size)
+                        queue.popleft()
+                        if queue:
+                            self.waiting.move_to_end(key)  # próximo bloco deste IP só depois dos outros
+                        else:
+                            del self.waiting[key]
+                        self.waited += time.monotonic() - started
+                        self.condition.notify_all()
+                        return
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+
+    def throttle(self, key):
+        # Função chamada antes de enviar cada bloco de uma conexão, ou None sem limites
+        if not self.enabled():
+            return None
+        bucket = None
+        if self.per_connection_rate:
+            bucket = TokenBucket(self.per_connection_rate, max(self.per_connection_rate // 4, self.chunk_size))
+
+        def wait(size):
+            if bucket is not None:
+                waited = bucket.wait(size)
+                with self.condition:
+                    self.waited += waited
+            self.acquire(key, size)
+        return wait
+
+    def pending(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.waiting.values())
@@ -0,0 +1,189 @@
+import itertools
+import os
+import re
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def extension_of(lower_name):
+    return os.path.splitext(lower_name)[1].lstrip('.')
+
+
+WORD_BOUNDARY = re.compile(r'[\W_]')
+
+
+class SearchQuery:
+    # Termos (todos precisam aparecer no nome), extensões aceitas e faixa de tamanho;
+    # group é o número de pares amostrados por arquivo quando os resultados são agrupados
+    def __init__(self, terms=(), extensions=(), min_size=None, max_size=None, ranked=False, group=None):
+        self.terms = [term.lower() for term in terms if term]
+        self.extensions = {extension.lower().lstrip('.') for extension in extensions if extension}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.ranked = ranked
+        self.group = group
+
+    def matches_name(self, lower_name):
+        if self.extensions and extension_of(lower_name) not in self.extensions:
+            return False
+        return all(term in lower_name for term in self.terms)
+
+    def matches_size(self, size):
+        if self.min_size is not None and size < self.min_size:
+            return False
+        return self.max_size is None or size <= self.max_size
+
+    def quality(self, lower_name):
+        # Nome exato > prefixo > início de palavra > substring, somado por termo
+        stem = os.path.splitext(lower_name)[0]
+        score = 0
+        for term in self.terms:
+            if stem == term or lower_name == term:
+                score += 3
+            elif lower_name.startswith(term):
+                score += 2
+            else:
+                position = lower_name.find(term)
+                score += 1 if WORD_BOUNDARY.match(lower_name, position - 1) else 0
+        return score
+
+
+class NameIndex:
+    # Trigramas e extensões por nome em minúsculas; cada nome aponta para um conjunto
+    # de chaves definidas por quem usa o índice
+    def __init__(self):
+        self.names = {}       # nome em minúsculas -> {chave}
+        self.postings = {}    # trigrama -> {nome em minúsculas}
+        self.extensions = {}  # extensão -> {nome em minúsculas}
+
+    def add_name(self, lower_name, key):
+        holders = self.names.get(lower_name)
+        if holders is None:
+            holders = self.names[lower_name] = set()
+            for gram in trigrams(lower_name):
+                self.postings.setdefault(gram, set()).add(lower_name)
+            self.extensions.setdefault(extension_of(lower_name), set()).add(lower_name)
+        holders.add(key)
+
+    def discard_name(self, lower_name, key):
+        holders = self.names[lower_name]
+        holders.discard(key)
+        if not holders:
+            del self.names[lower_name]
+            for gram in trigrams(lower_name):
+                posting = self.postings[gram]
+                posting.discard(lower_name)
+                if not posting:
+                    del self.postings[gram]
+            extension = extension_of(lower_name)
+            self.extensions[extension].discard(lower_name)
+            if not self.extensions[extension]:
+                del self.extensions[extension]
+
+    def candidate_names(self, query):
+        # Interseção das listas de trigramas de todos os termos, restrita às extensões;
+        # None quando a consulta não tem nada indexável
+        postings = [self.postings.get(gram, ()) for term in query.terms for gram in trigrams(term)]
+        if query.extensions:
+            extension_names = set()
+            for extension in query.extensions:
+                extension_names.update(self.extensions.get(extension, ()))
+            postings.append(extension_names)
+        if not postings:
+            return None
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return candidates
+
+    def match_query(self, query):
+        candidates = self.candidate_names(query)
+        if candidates is None:
+            candidates = self.names
+        return [name for name in candidates if query.matches_name(name)]
+
+    def is_indexed(self, query):
+        return any(len(term) >= 3 for term in query.terms) or bool(query.extensions)
+
+    def match_count(self, names):
+        return sum(len(self.names[name]) for name in names)
+
+
+class SearchIndex(NameIndex):
+    def __init__(self, seq=None):
+        super().__init__()
+        self.entries = {}   # (ip, filename) -> (seq, size, hash)
+        # ip -> (seq, {filename: nome em minúsculas}); a ordem de inserção dos dois
+        # dicionários coincide com a ordem das sequências
+        self.peers = {}
+        # Vários índices (um por shard) podem compartilhar a mesma sequência para
+        # manter uma ordem global entre eles
+        self.seq = seq if seq is not None else itertools.count()
+
+    def add_peer(self, ip_address):
+        if ip_address not in self.peers:
+            self.peers[ip_address] = (next(self.seq), {})
+
+    def add(self, ip_address, filename, size, content_hash=None):
+        self.add_peer(ip_address)
+        key = (ip_address, filename)
+        if key in self.entries:
+            self.remove(ip_address, filename)
+
+        lower_name = filename.lower()
+        self.entries[key] = (next(self.seq), size, content_hash)
+        self.peers[ip_address][1][filename] = lower_name
+        self.add_name(lower_name, key)
+
+    def remove(self, ip_address, filename):
+        key = (ip_address, filename)
+        if self.entries.pop(key, None) is None:
+            return
+
+        del self.peers[ip_address][1][filename]
+        self.discard_name(filename.lower(), key)
+
+    def remove_peer(self, ip_address):
+        peer = self.peers.get(ip_address)
+        if peer is None:
+            return
+        for filename in list(peer[1]):
+            self.remove(ip_address, filename)
+        del self.peers[ip_address]
+
+    def ordered_rows(self, names, after=None, query=None):
+        results = []
+        for name in names:
+            for ip_address, filename in self.names[name]:
+                entry = self.entries[(ip_address, filename)]
+                order = (self.peers[ip_address][0], entry[0])
+                if (after is None or order > after) and (query is None or query.matches_size(entry[1])):
+                    results.append((order, (filename, ip_address) + entry[1:]))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def peer_order(self, after=None):
+        return [(peer_seq, ip_address) for ip_address, (peer_seq, _) in self.peers.items()
+                if after is None or peer_seq >= after[0]]
+
+    def peer_rows(self, ip_address, peer_seq, query, names=None, after=None):
+        peer = self.peers.get(ip_address)
+        if peer is None or peer[0] != peer_seq:
+            return []
+        results = []
+        for filename, lower_name in peer[1].items():
+            entry = self.entries[(ip_address, filename)]
+            order = (peer_seq, entry[0])
+            if after is not None and order <= after:
+                continue
+            if not query.matches_size(entry[1]):
+                continue
+            if (lower_name in names) if names is not None else query.matches_name(lower_name):
+                results.append((order, (filename, ip_address) + entry[1:]))
+        return results
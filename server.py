@@ -1,6 +1,9 @@
 from napster_server import NapsterServer
+from async_server import AsyncNapsterServer
+from log_setup import configure_logging
 
 def main():
+    configure_logging()
     print("=== SERVIDOR NAPSTER ===")
     print("Instruções:")
     print("1. O servidor escutará na porta especificada (padrão: 1234)")
@@ -11,8 +14,12 @@ def main():
     host = input("Digite o host (Enter para localhost): ").strip() or 'localhost'
     port_input = input("Digite a porta (Enter para 1234): ").strip()
     port = int(port_input) if port_input else 1234
+    engine = input("Digite o motor (threads/asyncio, Enter para threads): ").strip().lower() or 'threads'
     
-    server = NapsterServer(host, port)
+    if engine == 'asyncio':
+        server = AsyncNapsterServer(host, port, data_folder='./server_data')
+    else:
+        server = NapsterServer(host, port, data_folder='./server_data')
     server.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+class ShareWatcher:
+    def __init__(self, file_manager, cache_path="./.share_cache.json", interval=10.0, full_scan_interval=300.0):
+        self.file_manager = file_manager
+        self.cache_path = Path(cache_path)
+        self.interval = interval
+        # Entre varreduras completas só as pastas alteradas são relidas; arquivos editados
+        # no lugar aparecem na próxima completa
+        self.full_scan_interval = full_scan_interval
+        self.last_full_scan = None
+        self.files = {}  # caminho relativo -> file_info (com hashes das peças)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.cache_path.exists():
+            return
+        try:
+            cached = json.loads(self.cache_path.read_text())
+            if cached.get('shared_folder') != os.path.abspath(self.file_manager.shared_folder):
+                return
+            for file_info in cached['files']:
+                self.files[file_info['path']] = file_info
+                self.file_manager.store_hash(file_info, file_info['hash'], file_info['pieces'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Cache de compartilhamento ignorado: {e}")
+            self.files = {}
+
+    def save(self):
+        data = {
+            'shared_folder': os.path.abspath(self.file_manager.shared_folder),
+            'files': list(self.files.values())
+        }
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, self.cache_path)
+
+    def poll(self):
+        with self.lock:
+            return self._poll()
+
+    def _poll(self):
+        now = time.monotonic()
+        full = self.last_full_scan is None or now - self.last_full_scan >= self.full_scan_interval
+        if full:
+            self.last_full_scan = now
+        current = {file_info['path']: file_info for file_info in self.file_manager.walk_files(full)}
+
+        changed = []
+        for path, file_info in current.items():
+            known = self.files.get(path)
+            if known is None or known['size'] != file_info['size'] or known['mtime'] != file_info['mtime']:
+                changed.append(file_info)
+        removed = [file_info for path, file_info in self.files.items() if path not in current]
+
+        if changed:
+            self.file_manager.hash_files(changed)
+            for file_info in changed:
+                file_info['pieces'] = self.file_manager.cached_hash(file_info)[1]
+                self.files[file_info['path']] = file_info
+        for file_info in removed:
+            del self.files[file_info['path']]
+
+        if changed or removed:
+            self.save()
+        return changed, removed
+
+    def start(self, callback):
+        self.stop_event.clear()
+        thread = threading.Thread(target=self.watch, args=(callback,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def watch(self, callback):
+        while not self.stop_event.wait(self.interval):
+            try:
+                changed, removed = self.poll()
+                if changed or removed:
+                    callback(changed, removed)
+            except Exception as e:
+                print(f"Erro ao monitorar a pasta compartilhada: {e}")
+
+    def stop(self):
+        self.stop_event.set()
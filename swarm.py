@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from pathlib import Path
+from protocol import FileTransferProtocol, RECV_BUFFER_SIZE
+from download_journal import DownloadJournal
+from file_handler import preallocate
+
+class PeerBusy(ConnectionError):
+    pass
+
+class Segment:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    def remaining(self):
+        return self.end - self.position
+
+class SwarmDownload:
+    def __init__(self, filename, size, peers, connection_pool, folder="./downloads", verifier=None,
+                 segment_size=4 * 1024 * 1024, min_split=256 * 1024, buffer_size=RECV_BUFFER_SIZE,
+                 max_bad_pieces=3, max_busy_retries=5, busy_delay=0.5, compression=(), content_hash=None):
+        self.filename = filename
+        self.size = size
+        self.content_hash = content_hash
+        self.peers = list(dict.fromkeys(peers))
+        self.connection_pool = connection_pool
+        self.folder = folder
+        self.segment_size = segment_size
+        self.min_split = min_split
+        self.buffer_size = buffer_size
+        self.verifier = verifier
+        self.max_bad_pieces = max_bad_pieces
+        self.bad_pieces_by_peer = {}
+        self.max_busy_retries = max_busy_retries
+        self.busy_delay = busy_delay
+        self.compression = compression
+        self.pending = []
+        self.active = []
+        self.journal = None
+        self.lock = threading.Condition()
+        self.bytes_by_peer = {}
+
+    def next_segment(self):
+        with self.lock:
+            while True:
+                if self.pending:
+                    segment = self.pending.pop(0)
+                    break
+                # Sem trabalho pendente: divide o segmento ativo mais atrasado ao meio
+                segment = self.split_slowest()
+                if segment is not None:
+                    break
+                if not self.active:
+                    return None
+                # Nada para dividir, mas um segmento em andamento ainda pode voltar para a
+                # fila (fonte que falhou, peça corrompida): espera em vez de abandonar
+                self.lock.wait()
+            self.active.append(segment)
+            return segment
+
+    def split_slowest(self):
+        slowest = max(self.active, key=Segment.remaining, default=None)
+        if slowest is None or slowest.remaining() < 2 * self.min_split:
+            return None
+        middle = slowest.position + slowest.remaining() // 2
+        if self.verifier:
+            # Divisões caem em fronteiras de peça para que cada fluxo seja verificável
+            middle = self.verifier.align(middle, middle)[1]
+            if middle >= slowest.end:
+                return None
+        segment = Segment(middle, slowest.end)
+        slowest.end = middle
+        return segment
+
+    def release_segment(self, segment):
+        with self.lock:
+            self.active.remove(segment)
+            if segment.remaining() > 0:
+                start, end = segment.position, segment.end
+                if self.verifier:
+                    # Bytes de uma peça incompleta não foram verificados: recomeça do início dela
+                    start, end = self.verifier.align(start, end)
+                self.pending.append(Segment(start, end))
+            self.lock.notify_all()
+
+    def fetch_segment(self, fd, ip_address, segment):
+        connection = self.connection_pool.acquire(ip_address)
+        # Reutilizável só com a resposta lida até o fim; BUSY, timeout ou erro fecham a conexão
+        reusable = False
+        received = bytes_to_receive = 0
+        try:
+            download_stream = connection.stream
+            FileTransferProtocol.send_get_command(download_stream, self.filename, segment.position, segment.end,
+                                                  self.compression)
+
+            response = FileTransferProtocol.receive_response(download_stream)
+            if response.startswith("BUSY"):
+                raise PeerBusy(response)
+            size, codec = FileTransferProtocol.parse_get_response(response)
+            if size is None:
+                reusable = response.startswith("ERROR")
+                raise ConnectionError(response)
+            bytes_to_receive = size
+
+            pieces = self.verifier.stream(segment.position) if self.verifier else None
+            buffer = memoryview(bytearray(self.buffer_size))
+
+            for data in FileTransferProtocol.receive_chunks(download_stream, bytes_to_receive, buffer, codec):
+                received += len(data)
+                with self.lock:
+                    # O fim pode ter sido reduzido por outro worker que dividiu o segmento
+                    data = data[:max(0, segment.end - segment.position)]
+                    os.pwrite(fd, data, segment.position)
+                    if pieces is None:
+                        self.journal.add(segment.position, segment.position + len(data), fd)
+                    else:
+                        self.record_pieces(fd, ip_address, pieces.update(data))
+                    segment.position += len(data)
+                    self.bytes_by_peer[ip_address] = self.bytes_by_peer.get(ip_address, 0) + len(data)
+                    shortened = segment.position >= segment.end
+                # Só abandona a resposta no meio se o segmento encolheu; lida até o fim, a
+                # conexão fica limpa para reutilização
+                if shortened and received < bytes_to_receive:
+                    break
+            if received < bytes_to_receive and segment.remaining() > 0:
+                raise ConnectionError("Conexão encerrada antes do fim do segmento")
+            # Um segmento encurtado por divisão deixa bytes pendentes no socket: não reutiliza
+            reusable = received == bytes_to_receive
+        finally:
+            self.connection_pool.release(connection, reusable=reusable)
+
+    def record_pieces(self, fd, ip_address, completed):
+        for piece_start, piece_end, ok in completed:
+            if ok:
+                self.journal.add(piece_start, piece_end, fd)
+            else:
+                print(f"Peça {piece_start}-{piece_end} recebida de {ip_address} corrompida; será baixada novamente")
+                self.pending.append(Segment(piece_start, piece_end))
+                self.lock.notify_all()
+                self.bad_pieces_by_peer[ip_address] = self.bad_pieces_by_peer.get(ip_address, 0) + 1
+
+    def worker(self, fd, ip_address):
+        busy = 0
+        while True:
+            if self.bad_pieces_by_peer.get(ip_address, 0) >= self.max_bad_pieces:
+                print(f"Fonte {ip_address} descartada por enviar peças corrompidas")
+                return
+            segment = self.next_segment()
+            if segment is None:
+                return
+            try:
+                self.fetch_segment(fd, ip_address, segment)
+                busy = 0
+            except PeerBusy:
+                busy += 1
+            except Exception as e:
+                print(f"Falha ao baixar de {ip_address}: {e}")
+                return
+            finally:
+                self.release_segment(segment)
+            if busy:
+                # Fonte lotada: devolve o segmento para as outras e tenta de novo mais tarde
+                if busy > self.max_busy_retries:
+                    print(f"Fonte {ip_address} continua ocupada; desistindo dela")
+                    return
+                time.sleep(self.busy_delay * busy)
+
+    def run(self):
+        Path(self.folder).mkdir(parents=True, exist_ok=True)
+        file_path = Path(self.folder) / self.filename
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.journal = DownloadJournal(file_path)
+        try:
+            if self.journal.size != self.size or self.journal.content_hash != self.content_hash:
+                preallocate(fd, self.size)
+                self.journal.start(self.size, self.content_hash)
+            else:
+                print(f"Retomando download de {self.filename}: faltam {self.journal.missing_bytes()} bytes")
+            for gap_start, gap_end in self.journal.missing():
+                if self.verifier:
+                    gap_start, gap_end = self.verifier.align(gap_start, gap_end)
+                self.pending.extend(Segment(start, min(start + self.segment_size, gap_end))
+                                    for start in range(gap_start, gap_end, self.segment_size))
+
+            workers = [threading.Thread(target=self.worker, args=(fd, ip_address))
+                       for ip_address in self.peers]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            self.journal.save(fd)
+            os.close(fd)
+
+        complete = self.journal.is_complete()
+        if complete:
+            self.journal.finish()
+        return file_path, complete
@@ -0,0 +1,137 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger('napster.pool')
+
+class Admission:
+    # Limita as conexões em andamento (atendidas + na fila), no total (None: sem teto) e por IP
+    def __init__(self, max_connections, max_per_ip):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.by_ip = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def admit(self, ip_address):
+        # Devolve None se a conexão foi aceita, ou o motivo da recusa
+        with self.lock:
+            if self.max_connections is not None and self.total >= self.max_connections:
+                return "Too many connections"
+            count = self.by_ip.get(ip_address, 0)
+            if count >= self.max_per_ip:
+                return "Too many connections from this address"
+            self.by_ip[ip_address] = count + 1
+            self.total += 1
+            return None
+
+    def release(self, ip_address):
+        with self.lock:
+            self.total -= 1
+            count = self.by_ip.get(ip_address, 0) - 1
+            if count > 0:
+                self.by_ip[ip_address] = count
+            else:
+                self.by_ip.pop(ip_address, None)
+
+class WorkerPool:
+    # Número limitado de threads atendendo conexões de uma fila também limitada. As
+    # threads são criadas sob demanda até max_workers e ficam esperando novas conexões;
+    # quem passa dos limites (ou espera mais que queue_timeout na fila) recebe `reject`
+    def __init__(self, handler, reject, max_workers=64, max_queue=128, max_per_ip=8, queue_timeout=10.0):
+        self.handler = handler
+        self.reject = reject
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self.admission = Admission(max_workers + max_queue, max_per_ip)
+        self.queue = collections.deque()  # (socket, endereço, instante em que entrou)
+        self.condition = threading.Condition()
+        self.workers = 0
+        self.idle = 0
+        self.busy = 0
+        self.rejected = 0
+        self.reaper = None
+        self.running = True
+
+    def submit(self, client_socket, address):
+        reason = self.admission.admit(address[0])
+        if reason is not None:
+            self.refuse(client_socket, address, reason)
+            return False
+        with self.condition:
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap)
+                self.reaper.daemon = True
+                self.reaper.start()
+            self.queue.append((client_socket, address, time.monotonic()))
+            # Threads ociosas já vão consumir parte da fila; só cria outra se faltar
+            if len(self.queue) > self.idle and self.workers < self.max_workers:
+                self.workers += 1
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+            self.condition.notify()
+        return True
+
+    def refuse(self, client_socket, address, reason):
+        with self.condition:
+            self.rejected += 1
+        try:
+            self.reject(client_socket, address, reason)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def work(self):
+        while True:
+            with self.condition:
+                self.idle += 1
+                while not self.queue and self.running:
+                    self.condition.wait()
+                self.idle -= 1
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                client_socket, address, queued_at = self.queue.popleft()
+                self.busy += 1
+            try:
+                if time.monotonic() - queued_at > self.queue_timeout:
+                    self.refuse(client_socket, address, "Server busy")
+                else:
+                    self.handler(client_socket, address)
+            except Exception as e:
+                logger.error("Erro ao atender %s: %s", address, e)
+            finally:
+                self.admission.release(address[0])
+                with self.condition:
+                    self.busy -= 1
+
+    def reap(self):
+        # Com todas as threads presas em sessões longas, ninguém tiraria da fila quem
+        # esperou demais; a recusa é feita aqui sem depender de uma thread livre
+        while self.running:
+            time.sleep(min(1.0, self.queue_timeout / 2))
+            deadline = time.monotonic() - self.queue_timeout
+            with self.condition:
+                expired = [entry for entry in self.queue if entry[2] < deadline]
+                if expired:
+                    self.queue = collections.deque(entry for entry in self.queue if entry[2] >= deadline)
+            for client_socket, address, _ in expired:
+                self.admission.release(address[0])
+                self.refuse(client_socket, address, "Server busy")
+
+    def queued(self):
+        with self.condition:
+            return len(self.queue)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            pending = list(self.queue)
+            self.queue.clear()
+            self.condition.notify_all()
+        for client_socket, address, _ in pending:
+            self.admission.release(address[0])
+            client_socket.close()